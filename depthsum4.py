@@ -1,10 +1,59 @@
 # -*- coding: utf-8 -*-
 import arcpy
 import os
-import datetime
+import sys
+import hashlib
+import importlib
+import json
 import math
+import shutil
+import tempfile
+import threading
 from arcpy import Geometry
 
+TOOLBOX_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if TOOLBOX_FOLDER not in sys.path:
+    sys.path.insert(0, TOOLBOX_FOLDER)
+
+DEPTH_DISTRIBUTIONS = ["None", "Lognormal", "Normal", "Uniform", "Empirical"]
+
+
+class LazyImport(object):
+    # Engines are imported on first use (execute, or the numpy-only preview), so opening the tool stays fast
+    def __init__(self, module_name, attribute=None):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            module = importlib.import_module(self._module_name)
+            self._target = getattr(module, self._attribute) if self._attribute else module
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+
+np = LazyImport("numpy")
+MeterageSimulator = LazyImport("depthsum_simulation", "MeterageSimulator")
+BandManifest = LazyImport("depthsum_checkpoint", "BandManifest")
+ProfileEngine = LazyImport("depthsum_engine", "ProfileEngine")
+RunLog = LazyImport("depthsum_runlog", "RunLog")
+RunCatalog = LazyImport("depthsum_catalog", "RunCatalog")
+HashGrid = LazyImport("depthsum_spatial", "HashGrid")
+AccessMask = LazyImport("depthsum_spatial", "AccessMask")
+RingSimplifier = LazyImport("depthsum_spatial", "RingSimplifier")
+DesignDiff = LazyImport("depthsum_diff", "DesignDiff")
+SamplePlan = LazyImport("depthsum_samples", "SamplePlan")
+HoleTrace = LazyImport("depthsum_traces", "HoleTrace")
+ProfileGrid = LazyImport("depthsum_grid", "ProfileGrid")
+TilePyramid = LazyImport("depthsum_tiles", "TilePyramid")
+CoverageRaster = LazyImport("depthsum_coverage", "CoverageRaster")
+
 
 class Toolbox(object):
     def __init__(self):
@@ -17,7 +66,7 @@ class PolygonToProfiles(object):
     def __init__(self):
         self.label = "Generate Profiles and Collars from Polygon"
         self.description = "Generates polylines at specified azimuth and spacing inside a polygon, then calculates total depth or generates collar points."
-        self.canRunInBackground = False
+        self.canRunInBackground = True
 
 
     @staticmethod
@@ -82,6 +131,379 @@ class PolygonToProfiles(object):
             direction="Input"
         ))
 
+        params.append(arcpy.Parameter(
+            displayName="Depth uncertainty distribution",
+            name="depth_distribution",
+            datatype="String",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[7].filter.type = "ValueList"
+        params[7].filter.list = DEPTH_DISTRIBUTIONS
+        params[7].value = "None"
+
+        params.append(arcpy.Parameter(
+            displayName="Depth standard deviation (meters)",
+            name="depth_sd",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Past campaign drillholes table (empirical distribution)",
+            name="empirical_table",
+            datatype="Table View",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Past campaign depth field",
+            name="empirical_field",
+            datatype="Field",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[10].parameterDependencies = [params[9].name]
+        params[10].filter.list = ["Short", "Long", "Float", "Double"]
+
+        params.append(arcpy.Parameter(
+            displayName="Number of simulation trials",
+            name="mc_trials",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[11].value = 10000
+
+        params.append(arcpy.Parameter(
+            displayName="Run simulation in parallel processes",
+            name="mc_parallel",
+            datatype="Boolean",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[12].value = False
+
+        params.append(arcpy.Parameter(
+            displayName="Simulation random seed (empty draws a new seed, which is written to the run log)",
+            name="mc_seed",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Profiles per processing band (0 processes the whole grid at once)",
+            name="band_size",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[14].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Resume interrupted banded run",
+            name="resume_bands",
+            datatype="Boolean",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[15].value = True
+
+        params.append(arcpy.Parameter(
+            displayName="Clipping engine",
+            name="clip_engine",
+            datatype="String",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[16].filter.type = "ValueList"
+        params[16].filter.list = ["Geoprocessing", "In-process"]
+        params[16].value = "Geoprocessing"
+
+        params.append(arcpy.Parameter(
+            displayName="Custom profile lines (roads, ridges, terraces) instead of a straight grid",
+            name="custom_profiles",
+            datatype="Feature Layer",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[17].filter.list = ["Polyline"]
+
+        params.append(arcpy.Parameter(
+            displayName="Priority infill zones (nested polygons with their own spacing and interval)",
+            name="infill_zones",
+            datatype="Feature Layer",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[18].filter.list = ["Polygon"]
+
+        params.append(arcpy.Parameter(
+            displayName="Zone profile spacing field",
+            name="zone_spacing_field",
+            datatype="Field",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[19].parameterDependencies = [params[18].name]
+        params[19].filter.list = ["Short", "Long", "Float", "Double"]
+
+        params.append(arcpy.Parameter(
+            displayName="Zone point interval field",
+            name="zone_interval_field",
+            datatype="Field",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[20].parameterDependencies = [params[18].name]
+        params[20].filter.list = ["Short", "Long", "Float", "Double"]
+
+        params.append(arcpy.Parameter(
+            displayName="Zone priority field (higher wins where collars coincide)",
+            name="zone_priority_field",
+            datatype="Field",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[21].parameterDependencies = [params[18].name]
+        params[21].filter.list = ["Short", "Long", "Float", "Double"]
+
+        params.append(arcpy.Parameter(
+            displayName="Collars of adjacent blocks (merged with new collars)",
+            name="adjacent_collars",
+            datatype="Feature Layer",
+            parameterType="Optional",
+            direction="Input",
+            multiValue=True
+        ))
+        params[22].filter.list = ["Point"]
+
+        params.append(arcpy.Parameter(
+            displayName="Collar merge tolerance (meters, 0 disables merging)",
+            name="merge_tolerance",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[23].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Access raster (slope in degrees, or no-go where non-zero)",
+            name="access_raster",
+            datatype="Raster Layer",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Maximum drillable slope (degrees, empty for a no-go raster)",
+            name="max_slope",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Maximum collar relocation along profile (meters)",
+            name="max_relocation",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Hole dip (degrees below horizontal, empty for vertical holes without traces)",
+            name="hole_dip",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Hole azimuth (degrees, empty for perpendicular to the profiles)",
+            name="hole_azimuth",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Average depth is measured",
+            name="depth_reference",
+            datatype="String",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[29].filter.type = "ValueList"
+        params[29].filter.list = ["Along hole", "Vertical depth"]
+        params[29].value = "Along hole"
+
+        params.append(arcpy.Parameter(
+            displayName="Downhole survey station interval (meters, empty for collar and end of hole only)",
+            name="survey_interval",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Boundary simplification tolerance (fraction of point interval, 0 keeps every vertex)",
+            name="simplify_tolerance",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[31].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Domain azimuth field (strike-following mode: each polygon feature keeps its own azimuth)",
+            name="domain_azimuth_field",
+            datatype="Field",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[32].parameterDependencies = [params[0].name]
+        params[32].filter.list = ["Short", "Long", "Float", "Double"]
+
+        params.append(arcpy.Parameter(
+            displayName="Domain profile spacing field (empty uses the profile spacing)",
+            name="domain_spacing_field",
+            datatype="Field",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[33].parameterDependencies = [params[0].name]
+        params[33].filter.list = ["Short", "Long", "Float", "Double"]
+
+        params.append(arcpy.Parameter(
+            displayName="Previous design collars (compared with the new collars)",
+            name="previous_collars",
+            datatype="Feature Layer",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[34].filter.list = ["Point"]
+
+        params.append(arcpy.Parameter(
+            displayName="Design comparison tolerance (meters, empty for half the point interval)",
+            name="diff_tolerance",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Sample ID prefix (geochemistry mode)",
+            name="sample_prefix",
+            datatype="String",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[36].value = "S"
+
+        params.append(arcpy.Parameter(
+            displayName="First sample number",
+            name="first_sample_number",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[37].value = 1
+
+        params.append(arcpy.Parameter(
+            displayName="Field duplicate after every N samples (0 for none)",
+            name="duplicate_every",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[38].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Certified standard after every N samples (0 for none)",
+            name="standard_every",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[39].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Blank after every N samples (0 for none)",
+            name="blank_every",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[40].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Lab batch size (0 for a single batch)",
+            name="lab_batch_size",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[41].value = 0
+
+        params.append(arcpy.Parameter(
+            displayName="Tile export folder (z/x/y tile pyramid of profiles and collars for field tablets)",
+            name="tile_folder",
+            datatype="DEFolder",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Tile minimum zoom",
+            name="tile_min_zoom",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[43].value = 12
+        params[43].filter.type = "Range"
+        params[43].filter.list = [0, 22]
+
+        params.append(arcpy.Parameter(
+            displayName="Tile maximum zoom (every collar is kept at this zoom, thinned below it)",
+            name="tile_max_zoom",
+            datatype="Long",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[44].value = 17
+        params[44].filter.type = "Range"
+        params[44].filter.list = [0, 22]
+
+        params.append(arcpy.Parameter(
+            displayName="Coverage raster cell size (meters, empty skips coverage analytics)",
+            name="coverage_cell",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Coverage gap distance (meters from the nearest collar, empty for the profile spacing)",
+            name="gap_distance",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+
+        params.append(arcpy.Parameter(
+            displayName="Density window (meters)",
+            name="density_window",
+            datatype="Double",
+            parameterType="Optional",
+            direction="Input"
+        ))
+        params[47].value = 1000
+
         return params
 
 
@@ -92,86 +514,431 @@ class PolygonToProfiles(object):
 
     @staticmethod
     def updateParameters(parameters):
-        if parameters[5].value:  # Geochem mode
-            parameters[4].enabled = False
+        params = {parameter.name: parameter for parameter in parameters}
+        if params["geochem_mode"].value:
+            params["depth_value"].enabled = False
         else:
-            parameters[4].enabled = True
+            params["depth_value"].enabled = True
+
+        distribution = params["depth_distribution"].valueAsText or "None"
+        simulate = not params["geochem_mode"].value and distribution != "None"
+        params["depth_distribution"].enabled = not params["geochem_mode"].value
+        params["depth_sd"].enabled = simulate and distribution != "Empirical"
+        params["empirical_table"].enabled = simulate and distribution == "Empirical"
+        params["empirical_field"].enabled = simulate and distribution == "Empirical"
+        params["mc_trials"].enabled = simulate
+        params["mc_parallel"].enabled = simulate
+        params["mc_seed"].enabled = simulate
+        custom_profiles = bool(params["custom_profiles"].value)
+        domains = bool(params["domain_azimuth_field"].value) and not custom_profiles
+        infill_zones = bool(params["infill_zones"].value) and not domains
+        params["clip_engine"].enabled = not custom_profiles and not infill_zones and not domains
+        params["infill_zones"].enabled = not custom_profiles and not domains
+        for name in ("zone_spacing_field", "zone_interval_field", "zone_priority_field"):
+            params[name].enabled = infill_zones and not custom_profiles
+        params["domain_azimuth_field"].enabled = not custom_profiles
+        params["domain_spacing_field"].enabled = domains
+        params["diff_tolerance"].enabled = bool(params["previous_collars"].value)
+        for name in ("sample_prefix", "first_sample_number", "duplicate_every", "standard_every", "blank_every",
+                     "lab_batch_size"):
+            params[name].enabled = bool(params["geochem_mode"].value)
+        params["max_slope"].enabled = bool(params["access_raster"].value)
+        params["max_relocation"].enabled = bool(params["access_raster"].value)
+        in_process = ((params["clip_engine"].valueAsText == "In-process" or infill_zones or domains)
+                      and not custom_profiles)
+        params["band_size"].enabled = not in_process
+        params["resume_bands"].enabled = not in_process and bool(params["band_size"].value)
+        params["hole_dip"].enabled = not params["geochem_mode"].value
+        for name in ("hole_azimuth", "depth_reference", "survey_interval"):
+            params[name].enabled = not params["geochem_mode"].value and params["hole_dip"].value is not None
+        params["tile_min_zoom"].enabled = bool(params["tile_folder"].value)
+        params["tile_max_zoom"].enabled = bool(params["tile_folder"].value)
+        params["gap_distance"].enabled = bool(params["coverage_cell"].value)
+        params["density_window"].enabled = bool(params["coverage_cell"].value)
         return
 
     def updateMessages(self, parameters):
+        params = {parameter.name: parameter for parameter in parameters}
+        if not params["geochem_mode"].value and params["depth_value"].value is None:
+            params["depth_value"].setErrorMessage("Average hole depth is required unless geochem mode is on")
+        estimate = PreviewHelper.estimate(parameters)
+        if estimate and not params["in_polygons"].message:
+            meterage = ""
+            if not params["geochem_mode"].value and params["depth_value"].value:
+                meterage = f", ~{estimate['collars'] * params['depth_value'].value} m of drilling"
+            params["in_polygons"].setWarningMessage(f"Estimate: ~{estimate['profiles']} profiles, "
+                                                    f"~{estimate['collars']} collars{meterage}")
+        min_zoom, max_zoom = params["tile_min_zoom"].value, params["tile_max_zoom"].value
+        if params["tile_folder"].value and min_zoom is not None and max_zoom is not None and min_zoom > max_zoom:
+            params["tile_max_zoom"].setErrorMessage("Maximum zoom must not be below the minimum zoom")
+        if params["hole_dip"].enabled and params["hole_dip"].value is not None and \
+                not 0 < params["hole_dip"].value <= 90:
+            params["hole_dip"].setErrorMessage("Hole dip must be above 0 and at most 90 degrees below horizontal")
+        survey_interval = params["survey_interval"]
+        if survey_interval.enabled and survey_interval.value is not None and survey_interval.value <= 0:
+            survey_interval.setErrorMessage("Survey interval must be greater than 0")
         return
 
 
     def execute(self, parameters, messages):
+        workspace = None
+        params = {parameter.name: parameter for parameter in parameters}
         try:
-            polygon_layer = parameters[0].valueAsText
-            spacing = parameters[1].value
-            azimuth = parameters[2].value
-            point_interval = parameters[3].value
-            avg_depth = parameters[4].value if not parameters[5].value else None
-            geochem_mode = parameters[5].value
-            utm_zone = parameters[6].value
+            polygon_layer = params["in_polygons"].valueAsText
+            spacing = params["profile_spacing"].value
+            azimuth = params["azimuth"].value
+            point_interval = params["point_interval"].value
+            avg_depth = params["depth_value"].value if not params["geochem_mode"].value else None
+            geochem_mode = params["geochem_mode"].value
+            utm_zone = params["utm_zone"].value
+            depth_distribution = params["depth_distribution"].valueAsText or "None"
+            depth_sd = params["depth_sd"].value or 0.0
+            empirical_table = params["empirical_table"].valueAsText
+            empirical_field = params["empirical_field"].valueAsText
+            mc_trials = params["mc_trials"].value or 10000
+            mc_parallel = params["mc_parallel"].value
+            mc_seed = params["mc_seed"].value
+            band_size = params["band_size"].value or 0
+            resume_bands = params["resume_bands"].value
+            clip_engine = params["clip_engine"].valueAsText or "Geoprocessing"
+            custom_profiles = params["custom_profiles"].valueAsText
+            adjacent_collars = (params["adjacent_collars"].valueAsText.split(";")
+                                if params["adjacent_collars"].valueAsText else [])
+            merge_tolerance = params["merge_tolerance"].value or 0
+            access_raster = params["access_raster"].valueAsText
+            max_slope = params["max_slope"].value
+            max_relocation = params["max_relocation"].value or 0
+            hole_dip = params["hole_dip"].value if not geochem_mode else None
+            hole_azimuth = params["hole_azimuth"].value
+            vertical_depth = params["depth_reference"].valueAsText == "Vertical depth"
+            survey_interval = params["survey_interval"].value
+            simplify_tolerance = (params["simplify_tolerance"].value or 0) * point_interval
+            previous_collars = params["previous_collars"].valueAsText
+            diff_tolerance = params["diff_tolerance"].value or point_interval / 2.0
+            sample_options = {
+                "prefix": params["sample_prefix"].valueAsText or "",
+                "first_number": params["first_sample_number"].value or 1,
+                "duplicate_every": params["duplicate_every"].value or 0,
+                "standard_every": params["standard_every"].value or 0,
+                "blank_every": params["blank_every"].value or 0,
+                "batch_size": params["lab_batch_size"].value or 0,
+            }
+            tile_folder = params["tile_folder"].valueAsText
+            tile_zooms = (params["tile_min_zoom"].value if params["tile_min_zoom"].value is not None else 12,
+                          params["tile_max_zoom"].value if params["tile_max_zoom"].value is not None else 17)
+            coverage_cell = params["coverage_cell"].value or 0
+            gap_distance = params["gap_distance"].value or spacing
+            density_window = params["density_window"].value or 1000
+            domains = None
+            if params["domain_azimuth_field"].valueAsText and not custom_profiles:
+                domains = (params["domain_azimuth_field"].valueAsText, params["domain_spacing_field"].valueAsText)
+                clip_engine = "In-process"
+            infill_zones = None
+            if params["infill_zones"].valueAsText and not custom_profiles and not domains:
+                infill_zones = (params["infill_zones"].valueAsText, params["zone_spacing_field"].valueAsText,
+                                params["zone_interval_field"].valueAsText, params["zone_priority_field"].valueAsText)
+                clip_engine = "In-process"
+            if custom_profiles:
+                clip_engine = "Geoprocessing"
 
             arcpy.env.overwriteOutput = True
 
-            toolbox_folder = os.path.dirname(__file__)
-            custom_scratch_gdb = os.path.join(toolbox_folder, "scratch.gdb")
-            if not arcpy.Exists(custom_scratch_gdb):
-                arcpy.CreateFileGDB_management(toolbox_folder, "scratch")
-
-            arcpy.env.scratchWorkspace = custom_scratch_gdb
-            scratch_gdb = arcpy.env.scratchGDB
-
-            profile_lines = os.path.join(scratch_gdb, "profiles")
-            collar_points = os.path.join(scratch_gdb, "collars")
-
-            fishnet_fc = self.generate_profiles(polygon_layer, spacing, azimuth, profile_lines, utm_zone)
-            self.generate_points(profile_lines, point_interval, collar_points)
-
-            self.cutting_by_polygon(polygon_layer, profile_lines, collar_points)
+            toolbox_folder = TOOLBOX_FOLDER
+            run_log = RunLog(os.path.join(os.path.expanduser("~"), "Desktop", "DepthLogs"))
+            workspace = RunWorkspace(toolbox_folder, run_log.run_id)
+
+            profile_lines = os.path.join(workspace.output_gdb, "profiles")
+            collar_points = os.path.join(workspace.output_gdb, "collars")
+            hole_traces = os.path.join(workspace.output_gdb, "holes")
+            removed_collars = os.path.join(workspace.output_gdb, "removed_collars")
+            sample_table = os.path.join(workspace.output_gdb, "sample_sequence")
+            batch_table = os.path.join(workspace.output_gdb, "batch_manifest")
+            distance_raster = os.path.join(workspace.results_folder, f"run_{run_log.run_id}_distance.tif")
+            density_raster = os.path.join(workspace.results_folder, f"run_{run_log.run_id}_density.tif")
+
+            run_log.params = {
+                "spacing": spacing, "azimuth": azimuth, "point_interval": point_interval,
+                "avg_depth": avg_depth, "geochem_mode": bool(geochem_mode), "utm_zone": utm_zone,
+                "depth_distribution": depth_distribution, "mc_seed": mc_seed, "band_size": band_size,
+                "clip_engine": clip_engine,
+                "custom_profiles": custom_profiles, "infill_zones": infill_zones, "domains": domains,
+                "adjacent_collars": adjacent_collars, "merge_tolerance": merge_tolerance,
+                "access_raster": access_raster, "max_slope": max_slope, "max_relocation": max_relocation,
+                "hole_dip": hole_dip, "hole_azimuth": hole_azimuth, "vertical_depth": vertical_depth,
+                "survey_interval": survey_interval, "simplify_tolerance": simplify_tolerance,
+                "previous_collars": previous_collars, "diff_tolerance": diff_tolerance,
+                "samples": sample_options if geochem_mode else None,
+                "tile_folder": tile_folder, "tile_zooms": tile_zooms if tile_folder else None,
+                "coverage_cell": coverage_cell, "gap_distance": gap_distance if coverage_cell else None,
+                "density_window": density_window if coverage_cell else None,
+            }
+            run_log.polygon_hash = self.polygon_fingerprint(polygon_layer)
+            input_polygon = polygon_layer
+
+            simplification = None
+            if simplify_tolerance > 0:
+                polygon_layer, simplification = self.simplify_polygon(
+                    polygon_layer, run_log.polygon_hash, simplify_tolerance, spacing, point_interval,
+                    avg_depth, utm_zone, [field for field in (domains or ()) if field])
+                run_log.mark("simplification")
+
+            # Every branch ends in a ProfileGrid; feature classes are read and written only at the edges.
+            # Banded runs are the exception: their collars stay on disk unless a stage has to edit or
+            # trace them, so peak memory stays bounded by the band size
+            ProgressHelper.start(6, "Generating profiles...")
+            line_oids = None
+            grid = None
+            orphans = 0
+            needs_grid = bool(merge_tolerance > 0 or access_raster or previous_collars or geochem_mode
+                              or (hole_dip is not None and avg_depth) or coverage_cell > 0)
+            if clip_engine == "In-process":
+                grid, spatial_ref = self.clip_in_process(
+                    polygon_layer, spacing, azimuth, point_interval, utm_zone, infill_zones, avg_depth, domains)
+            elif band_size:
+                manifest_folder = os.path.join(toolbox_folder, "checkpoints")
+                line_oids, line_ids, line_lengths, collar_counts = self.process_in_bands(
+                    polygon_layer, spacing, azimuth, point_interval, utm_zone, band_size, resume_bands,
+                    profile_lines, collar_points, manifest_folder, custom_profiles)
+                if needs_grid:
+                    arcpy.AddWarning("Banded run: merge, relocation, design comparison, sample planning, hole "
+                                     "traces and coverage load every collar into memory")
+            else:
+                if custom_profiles:
+                    self.copy_custom_profiles(custom_profiles, profile_lines, utm_zone)
+                else:
+                    self.generate_profiles(polygon_layer, spacing, azimuth, profile_lines, utm_zone)
+                run_log.mark("profiles")
+
+                ProgressHelper.stage(1, "Generating collars...")
+                self.generate_points(profile_lines, point_interval, collar_points)
+                run_log.mark("collars")
+
+                ProgressHelper.stage(2, "Clipping profiles and collars by polygon...")
+                line_oids, line_ids, line_lengths, collar_counts = self.cutting_by_polygon(polygon_layer, profile_lines, collar_points)
+            if line_oids is not None and (not band_size or needs_grid):
+                grid, spatial_ref, orphans = self.read_grid(collar_points, line_ids, line_lengths)
+                if orphans:
+                    arcpy.AddWarning(f"{orphans} collars without a profile were left out of the design")
+            run_log.mark("clipping")
+
+            # Orphan collars are removed from the collar layer too, so it matches the summary
+            collars_changed = bool(grid is not None and line_oids is not None and orphans)
+            if merge_tolerance > 0:
+                grid = self.merge_collars(grid, adjacent_collars, merge_tolerance, spatial_ref)
+                collars_changed = True
+                run_log.mark("merge")
+
+            if access_raster:
+                grid = self.relocate_collars(grid, access_raster, max_slope, max_relocation, azimuth, spatial_ref,
+                                             polygon_layer)
+                collars_changed = True
+                run_log.mark("relocation")
+
+            # Meterage of inclined holes is measured along the hole
+            hole_length = avg_depth
+            if hole_dip is not None and avg_depth:
+                if hole_azimuth is None:
+                    hole_azimuth = (azimuth + 90) % 360
+                hole_length = float(HoleTrace.hole_length(avg_depth, hole_dip, vertical_depth))
+
+            collar_fields, design_diff = None, None
+            if previous_collars:
+                collar_fields, design_diff, changed_profiles = self.diff_designs(
+                    grid, previous_collars, diff_tolerance, spatial_ref, hole_length, removed_collars)
+                run_log.set_diff(changed_profiles)
+                collars_changed = True
+                run_log.mark("diff")
+
+            sample_summary = None
+            if geochem_mode:
+                sample_fields, sample_summary = self.plan_samples(grid, sample_options, sample_table, batch_table)
+                collar_fields = {**(collar_fields or {}), **sample_fields}
+                collars_changed = True
+                run_log.mark("samples")
+
+            if line_oids is None:
+                line_oids = self.write_grid(grid, profile_lines, collar_points, spatial_ref, collar_fields)
+            elif collars_changed:
+                self.write_grid(grid, None, collar_points, spatial_ref, collar_fields)
+            if grid is not None:
+                line_ids, line_lengths, collar_counts = grid.profile_ids, grid.profile_lengths, grid.collar_counts()
+            n_collars = int(np.sum(collar_counts))
+
+            if hole_dip is not None and avg_depth:
+                self.generate_traces(grid, hole_traces, spatial_ref, hole_dip, hole_azimuth, hole_length,
+                                     survey_interval)
+                run_log.mark("traces")
+
+            ProgressHelper.stage(3, "Writing profile attributes...")
+            line_columns = {"ID": line_ids, "ProfileNumber": line_ids}
+            # Without a depth the profiles and collars are still written, only the meterage is left out
+            depths = self.add_depths(collar_counts, hole_length) if not geochem_mode and hole_length else None
+            if depths is not None:
+                line_columns["TotalMeterage"] = depths
+            CuttingHelper.write_fields(profile_lines, line_oids, line_columns, {"TotalMeterage": "DOUBLE"})
+            run_log.set_profiles(line_ids, line_lengths, collar_counts, depths)
+            run_log.summary = {
+                "profiles": len(line_ids),
+                "collars": n_collars,
+                "total_meterage": None if depths is None else float(np.sum(depths)),
+            }
+            if simplification:
+                run_log.summary["simplification"] = simplification
+            if design_diff:
+                run_log.summary["design_diff"] = design_diff
+            if sample_summary:
+                run_log.summary["samples"] = sample_summary
+            run_log.mark("attributes")
+
+            if tile_folder:
+                run_log.summary["tiles"] = self.export_tiles(profile_lines, collar_points, tile_folder, *tile_zooms)
+                run_log.mark("tiles")
+
+            if coverage_cell > 0:
+                run_log.summary["coverage"] = self.analyse_coverage(
+                    polygon_layer, grid, spatial_ref, coverage_cell, gap_distance, density_window,
+                    distance_raster, density_raster)
+                run_log.mark("coverage")
+
+            ProgressHelper.stage(4, "Simulating meterage...")
+            if not geochem_mode and hole_length:
+                if depth_distribution != "None":
+                    run_log.summary["simulation"] = self.simulate_meterage(
+                        n_collars, hole_length, depth_distribution, depth_sd,
+                        empirical_table, empirical_field, mc_trials, mc_parallel, mc_seed)
+                    run_log.mark("simulation")
+
+            ProgressHelper.stage(5, "Adding layers to map...")
+            map_layers = [(profile_lines, "profiles"), (collar_points, "collars")]
+            if hole_dip is not None and avg_depth:
+                map_layers.append((hole_traces, "holes"))
+            if previous_collars:
+                map_layers.append((removed_collars, "removed_collars"))
+            if geochem_mode:
+                map_layers.extend([(sample_table, "sample_sequence"), (batch_table, "batch_manifest")])
+            if coverage_cell > 0:
+                map_layers.extend([(distance_raster, "collar_distance"), (density_raster, "collar_density")])
+            self.add_layers_to_map(map_layers)
+            arcpy.SetParameter(0, collar_points)
+            run_log.mark("map")
 
-            if not geochem_mode:
-                self.add_depths(profile_lines, point_interval, avg_depth, "TotalMeterage",
-                                os.path.join(os.path.expanduser("~"), "Desktop", "DepthLogs"))
+            arcpy.AddMessage(f"Run log written: {run_log.flush()}")
+            # Catalogued by the input polygon, not the simplified copy the run may have used
+            self.catalog_run(run_log, input_polygon)
 
-            self.add_layer_to_map(profile_lines, "profiles")
-            self.add_layer_to_map(collar_points, "collars")
-            arcpy.SetParameter(0, collar_points)
+        except ToolCancelled as e:
+            arcpy.AddWarning(str(e))
 
         except Exception as e:
             arcpy.AddError("Execution failed: " + str(e))
 
-        try:
-            for name in ["projected_polygon", "raw_fishnet", "temp_fishnet_geomfix", "rotated_fishnet", "pivot_point_fc", "generated_points"]:
-                path = os.path.join(arcpy.env.scratchGDB, name)
-                if arcpy.Exists(path):
-                    arcpy.Delete_management(path)
-                    arcpy.AddMessage(f"{name} удалён")
-        except:
-            arcpy.AddWarning("Temporary objects are not deleted")
+        finally:
+            arcpy.ResetProgressor()
+            if workspace:
+                workspace.cleanup()
 
 
     @staticmethod
-    def generate_profiles(polygon_layer, spacing, azimuth, output_fc, utm_zone):
-        try:
-            desc = arcpy.Describe(polygon_layer)
-            spatial_ref = desc.spatialReference
+    def project_polygon(polygon_layer, utm_zone):
+        spatial_ref = arcpy.Describe(polygon_layer).spatialReference
+        if spatial_ref.type != "Geographic":
+            arcpy.AddMessage("Polygon reprojection is not required.")
+            return polygon_layer, spatial_ref
 
-            needs_projection = spatial_ref.type == "Geographic"
+        epsg_code = 32600 + int(utm_zone)
+        utm_sr = arcpy.SpatialReference(epsg_code)
 
+        projected_polygon = os.path.join(arcpy.env.scratchGDB, "projected_polygon")
+        if arcpy.Exists(projected_polygon):
+            arcpy.Delete_management(projected_polygon)
+        arcpy.Project_management(polygon_layer, projected_polygon, utm_sr)
+        return projected_polygon, utm_sr
 
-            if needs_projection:
-                epsg_code = 32600 + int(utm_zone)
-                utm_sr = arcpy.SpatialReference(epsg_code)
 
-                projected_polygon = os.path.join(arcpy.env.scratchGDB, "projected_polygon")
-                if arcpy.Exists(projected_polygon):
-                    arcpy.Delete_management(projected_polygon)
-                arcpy.Project_management(polygon_layer, projected_polygon, utm_sr)
-                polygon_layer = projected_polygon
-                spatial_ref = utm_sr
-            else:
-                arcpy.AddMessage("Polygon reprojection is not required.")
+    @staticmethod
+    def simplify_polygon(polygon_layer, polygon_hash, tolerance, spacing, interval, avg_depth, utm_zone,
+                         fields=()):
+        # fields (the domain azimuth and spacing) are copied onto the simplified features as DOUBLE
+        spatial_ref = arcpy.Describe(polygon_layer).spatialReference
+        if spatial_ref.type == "Geographic":
+            spatial_ref = arcpy.SpatialReference(32600 + int(utm_zone))
+
+        # Simplified boundaries are kept per polygon, tolerance and coordinate system, each in its own
+        # geodatabase so runs never share one. An entry is built under a private name, renamed into
+        # place and completed by its JSON report; a run that loses the rename race keeps the winner's
+        cache_folder = os.path.join(TOOLBOX_FOLDER, "cache")
+        name = f"poly_{polygon_hash[:16]}_{int(round(tolerance * 1000))}_{spatial_ref.factoryCode}"
+        if fields:
+            # The geometry fingerprint ignores attributes, so the copied values join the key
+            digest = hashlib.sha1("|".join(fields).encode("utf-8"))
+            with arcpy.da.SearchCursor(polygon_layer, list(fields)) as cursor:
+                for row in cursor:
+                    digest.update(repr(row).encode("utf-8"))
+            name += "_" + digest.hexdigest()[:8]
+        cache_gdb = os.path.join(cache_folder, name + ".gdb")
+        cached_fc = os.path.join(cache_gdb, name)
+        report_path = os.path.join(cache_folder, name + ".json")
+
+        effect = None
+        if os.path.exists(report_path) and arcpy.Exists(cached_fc):
+            with open(report_path, "r", encoding="utf-8") as file:
+                effect = json.load(file)
+        else:
+            os.makedirs(cache_folder, exist_ok=True)
+            build_name = f"{name}_{os.getpid()}_{threading.get_ident()}.gdb"
+            build_gdb = os.path.join(cache_folder, build_name)
+            if arcpy.Exists(build_gdb):
+                arcpy.Delete_management(build_gdb)
+            arcpy.CreateFileGDB_management(cache_folder, build_name)
+            build_fc = os.path.join(build_gdb, name)
+            arcpy.CreateFeatureclass_management(build_gdb, name, "POLYGON", spatial_reference=spatial_ref)
+            if fields:
+                arcpy.AddFields_management(build_fc, [[field, "DOUBLE"] for field in fields])
+
+            polygons = PolygonToProfiles.read_rings(polygon_layer, fields, spatial_ref=spatial_ref)
+            rings = [ring for _, shape_rings, _ in polygons for ring in shape_rings]
+            simplified = RingSimplifier.simplify(rings, tolerance)
+            with arcpy.da.InsertCursor(build_fc, ["SHAPE@"] + list(fields)) as cursor:
+                start = 0
+                for _, shape_rings, values in polygons:
+                    parts = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in ring.tolist()])
+                                         for ring in simplified[start:start + len(shape_rings)]])
+                    cursor.insertRow([arcpy.Polygon(parts, spatial_ref)] + list(values))
+                    start += len(shape_rings)
+
+            effect = RingSimplifier.effect(rings, simplified, tolerance, spacing, interval)
+            effect["tolerance"] = tolerance
+
+            arcpy.ClearWorkspaceCache_management(build_gdb)
+            try:
+                os.rename(build_gdb, cache_gdb)
+            except OSError:
+                # Another run published this entry first; the inputs are the same, so keep theirs
+                if not arcpy.Exists(cached_fc):
+                    raise
+                arcpy.Delete_management(build_gdb)
+            temp_report = f"{report_path}.{os.getpid()}_{threading.get_ident()}.tmp"
+            with open(temp_report, "w", encoding="utf-8") as file:
+                json.dump(effect, file, indent=2)
+            os.replace(temp_report, report_path)
+
+        meterage = ""
+        if avg_depth:
+            meterage = (f", meterage {effect['length_change'] / interval * avg_depth:+.0f} "
+                        f"(about ±{effect['collar_change_estimate'] * avg_depth})")
+        arcpy.AddMessage(f"Boundary simplified within {tolerance:g} m: {effect['vertices']} -> "
+                         f"{effect['simplified_vertices']} vertices; profile length "
+                         f"{effect['length_change']:+.1f} m (at most ±{effect['worst_length_change']:.1f} m), "
+                         f"collars about ±{effect['collar_change_estimate']} including one per boundary "
+                         f"crossing{meterage}")
+        return cached_fc, effect
+
+
+    @staticmethod
+    def generate_profiles(polygon_layer, spacing, azimuth, output_fc, utm_zone, strict=False):
+        # strict re-raises errors instead of reporting them, for callers that checkpoint the result
+        try:
+            polygon_layer, spatial_ref = PolygonToProfiles.project_polygon(polygon_layer, utm_zone)
 
             extent = arcpy.Describe(polygon_layer).extent
             with arcpy.da.SearchCursor(polygon_layer, ["SHAPE@"]) as cursor:
@@ -200,7 +967,7 @@ class PolygonToProfiles(object):
                 arcpy.Delete_management(temp_fishnet)
             arcpy.CopyFeatures_management(raw_fishnet, temp_fishnet)
 
-            rotated_fishnet = os.path.join(arcpy.env.scratchGDB, "profiles")
+            rotated_fishnet = output_fc
             if arcpy.Exists(rotated_fishnet):
                 arcpy.Delete_management(rotated_fishnet)
 
@@ -210,13 +977,15 @@ class PolygonToProfiles(object):
                 geometry_type="POLYLINE",
                 spatial_reference=spatial_ref
             )
+            arcpy.AddField_management(rotated_fishnet, "ProfileNumber", "LONG")
 
             angle_radians = math.radians(-azimuth)
             pivot_point = arcpy.Point(centroid.X, centroid.Y)
 
             with arcpy.da.SearchCursor(temp_fishnet, ["SHAPE@"]) as search_cursor, \
-                    arcpy.da.InsertCursor(rotated_fishnet, ["SHAPE@"]) as insert_cursor:
-                for row in search_cursor:
+                    arcpy.da.InsertCursor(rotated_fishnet, ["SHAPE@", "ProfileNumber"]) as insert_cursor:
+                for profile_num, row in enumerate(search_cursor, start=1):
+                    ProgressHelper.report(profile_num, "Rotating profiles")
                     geom = row[0]
                     points = [p for p in geom.getPart(0)]
                     rotated_points = []
@@ -227,40 +996,96 @@ class PolygonToProfiles(object):
                         new_y = centroid.Y + (dx * math.sin(angle_radians) + dy * math.cos(angle_radians))
                         rotated_points.append(arcpy.Point(new_x, new_y))
                     rotated_geom = arcpy.Polyline(arcpy.Array(rotated_points))
-                    insert_cursor.insertRow([rotated_geom])
+                    insert_cursor.insertRow([rotated_geom, profile_num])
 
             return rotated_fishnet
 
+        except ToolCancelled:
+            raise
+
         except Exception as e:
+            if strict:
+                raise
             arcpy.AddError(f"Generate profiles error: {e}")
 
 
     @staticmethod
-    def generate_points(line_layer, interval, output_fc):
+    def copy_custom_profiles(line_layer, output_fc, utm_zone, strict=False):
         try:
             spatial_ref = arcpy.Describe(line_layer).spatialReference
+            if spatial_ref.type == "Geographic":
+                spatial_ref = arcpy.SpatialReference(32600 + int(utm_zone))
+
+            if arcpy.Exists(output_fc):
+                arcpy.Delete_management(output_fc)
             arcpy.CreateFeatureclass_management(
                 out_path=os.path.dirname(output_fc),
                 out_name=os.path.basename(output_fc),
-                geometry_type="POINT",
+                geometry_type="POLYLINE",
                 spatial_reference=spatial_ref
             )
             arcpy.AddField_management(output_fc, "ProfileNumber", "LONG")
-            arcpy.AddField_management(output_fc, "PointNumber", "LONG")
-
-            with arcpy.da.SearchCursor(line_layer, ["OID@", "SHAPE@"]) as line_cursor, \
-                    arcpy.da.InsertCursor(output_fc, ["SHAPE@", "ProfileNumber", "PointNumber"]) as point_cursor:
-                for line_id, shape in line_cursor:
-                    length = shape.length
-                    pos = 0.0
-                    point_num = 1
-                    while pos < length:
-                        point = shape.positionAlongLine(pos)
-                        point_cursor.insertRow([point, line_id, point_num])
-                        pos += interval
-                        point_num += 1
+
+            with arcpy.da.SearchCursor(line_layer, ["SHAPE@"], spatial_reference=spatial_ref) as search_cursor, \
+                    arcpy.da.InsertCursor(output_fc, ["SHAPE@", "ProfileNumber"]) as insert_cursor:
+                for profile_num, row in enumerate(search_cursor, start=1):
+                    if row[0] is not None:
+                        insert_cursor.insertRow([row[0], profile_num])
+
+            return output_fc
+
+        except Exception as e:
+            if strict:
+                raise
+            arcpy.AddError(f"Custom profiles error: {e}")
+
+
+    @staticmethod
+    def read_paths(line_layer, interval, where_clause=None):
+        numbers, lines = [], []
+        with arcpy.da.SearchCursor(line_layer, ["ProfileNumber", "SHAPE@"], where_clause) as cursor:
+            for profile_count, (profile_num, shape) in enumerate(cursor, start=1):
+                ProgressHelper.report(profile_count, "Reading profiles")
+                if shape is None:
+                    continue
+                if shape.hasCurves:
+                    shape = shape.densify("DISTANCE", interval / 10.0, 0)
+                numbers.append(profile_num)
+                lines.append(json.loads(shape.JSON)["paths"])
+        return np.asarray(numbers, dtype=np.int64), lines
+
+
+    @staticmethod
+    def create_collar_fc(output_fc, spatial_ref):
+        arcpy.CreateFeatureclass_management(
+            out_path=os.path.dirname(output_fc),
+            out_name=os.path.basename(output_fc),
+            geometry_type="POINT",
+            spatial_reference=spatial_ref
+        )
+        arcpy.AddFields_management(output_fc, [["ProfileNumber", "LONG"], ["PointNumber", "LONG"]])
+
+
+    @staticmethod
+    def generate_points(line_layer, interval, output_fc, where_clause=None, strict=False):
+        try:
+            spatial_ref = arcpy.Describe(line_layer).spatialReference
+            PolygonToProfiles.create_collar_fc(output_fc, spatial_ref)
+
+            # All collars are placed in one vectorized pass over the profile vertices
+            numbers, lines = PolygonToProfiles.read_paths(line_layer, interval, where_clause)
+            point_line, point_num, x, y = ProfileEngine.sample_polylines(lines, interval)
+
+            with arcpy.da.InsertCursor(output_fc, ["SHAPE@XY", "ProfileNumber", "PointNumber"]) as point_cursor:
+                for row in zip(zip(x.tolist(), y.tolist()), numbers[point_line].tolist(), point_num.tolist()):
+                    point_cursor.insertRow(row)
+
+        except ToolCancelled:
+            raise
 
         except Exception as e:
+            if strict:
+                raise
             arcpy.AddError(f"Error generating points: {e}")
 
 
@@ -283,92 +1108,719 @@ class PolygonToProfiles(object):
             arcpy.Rename_management(clipped_lines, line_fc)
             arcpy.Rename_management(clipped_points, point_fc)
 
-            CuttingHelper.assign_sequential_id(line_fc, "ID")
+            # Profiles and collars carry ProfileNumber from creation, so clipped profiles are
+            # renumbered and matched to their collars without a spatial join
+            lines = arcpy.da.FeatureClassToNumPyArray(line_fc, ["OID@", "ProfileNumber", "SHAPE@LENGTH"])
+            line_ids = np.arange(1, len(lines) + 1, dtype=np.int32)
+            collar_counts = CuttingHelper.number_points(point_fc, lines["ProfileNumber"], line_ids, 1)
+
+            return lines["OID@"], line_ids, lines["SHAPE@LENGTH"], collar_counts
+
+        except Exception as e:
+            arcpy.AddError("Cutting by polygon error: " + str(e))
+
+
+    @staticmethod
+    def read_rings(polygon_layer, fields=(), spatial_ref=None):
+        rows = []
+        with arcpy.da.SearchCursor(polygon_layer, ["SHAPE@"] + list(fields), spatial_reference=spatial_ref) as cursor:
+            for row in cursor:
+                if row[0] is not None:
+                    rows.append((row[0], json.loads(row[0].JSON)["rings"], row[1:]))
+        return rows
+
+
+    @staticmethod
+    def clip_in_process(polygon_layer, spacing, azimuth, interval, utm_zone, zones=None, avg_depth=None,
+                        domains=None):
+        polygon_layer, spatial_ref = PolygonToProfiles.project_polygon(polygon_layer, utm_zone)
+        extent = arcpy.Describe(polygon_layer).extent
+
+        domain_fields = [field for field in (domains or ()) if field]
+        polygons = PolygonToProfiles.read_rings(polygon_layer, domain_fields)
+        centroid = polygons[0][0].centroid
+        rings = [ring for _, shape_rings, _ in polygons for ring in shape_rings]
+        origin = (centroid.X, centroid.Y)
+
+        if domains:
+            # Every feature is a domain with its own azimuth and spacing, gridded like a separate run
+            engine_domains = []
+            for shape, shape_rings, values in polygons:
+                engine_domains.append({
+                    "rings": shape_rings, "origin": (shape.centroid.X, shape.centroid.Y),
+                    "extent_width": shape.extent.width, "extent_height": shape.extent.height,
+                    "azimuth": values[0] if values[0] is not None else azimuth,
+                    "spacing": values[1] if len(values) > 1 and values[1] else spacing,
+                })
+            grid, seam_collars = ProfileEngine.clip_domains(engine_domains, interval)
+            arcpy.AddMessage(f"Strike-following domains: {len(engine_domains)} domains, "
+                             f"{seam_collars} seam collars removed")
+            per_domain = np.bincount(grid.col_zone, minlength=len(engine_domains))
+            profiles_per_domain = np.bincount(grid.profile_zone, minlength=len(engine_domains))
+            for index, (n_profiles, n_collars) in enumerate(zip(profiles_per_domain.tolist(), per_domain.tolist())):
+                meterage = f", meterage {n_collars * avg_depth}" if avg_depth else ""
+                arcpy.AddMessage(f"  Domain {index} (azimuth {engine_domains[index]['azimuth']}, spacing "
+                                 f"{engine_domains[index]['spacing']}): {n_profiles} profiles, "
+                                 f"{n_collars} collars{meterage}")
+        elif zones:
+            zone_layer, spacing_field, interval_field, priority_field = zones
+            fields = [spacing_field, interval_field] + ([priority_field] if priority_field else [])
+            engine_zones = [{"rings": rings, "spacing": spacing, "interval": interval, "priority": 0}]
+            for index, (_, zone_rings, values) in enumerate(
+                    PolygonToProfiles.read_rings(zone_layer, fields, spatial_ref), start=1):
+                engine_zones.append({"rings": zone_rings, "spacing": values[0], "interval": values[1],
+                                     "priority": values[2] if priority_field and values[2] is not None else index})
+            grid, duplicates = ProfileEngine.clip_zones(engine_zones, origin, extent.width, extent.height, azimuth)
+            arcpy.AddMessage(f"Variable-density grid: {len(engine_zones)} zones, "
+                             f"{duplicates} coinciding collars merged")
+            per_zone = np.bincount(grid.col_zone, minlength=len(engine_zones))
+            for zone_index, zone_collars in enumerate(per_zone.tolist()):
+                meterage = f", meterage {zone_collars * avg_depth}" if avg_depth else ""
+                arcpy.AddMessage(f"  Zone {zone_index} (spacing {engine_zones[zone_index]['spacing']}, "
+                                 f"interval {engine_zones[zone_index]['interval']}): {zone_collars} collars{meterage}")
+        else:
+            grid = ProfileEngine.clip_profiles(rings, origin, extent.width, extent.height,
+                                               spacing, azimuth, interval)
+        arcpy.AddMessage(f"In-process clipping: {grid.n_profiles} profiles, {grid.n_collars} collars "
+                         f"({grid.nbytes / 1e6:.1f} MB in memory)")
+        return grid, spatial_ref
+
+
+    @staticmethod
+    def read_grid(point_fc, line_ids, line_lengths):
+        # Collars written by the geoprocessing branches enter the shared grid model here. Collars left
+        # without a profile (ProfileNumber outside 1..n) are not part of the design and are not read, so
+        # n_collars and collar_counts() agree; returns the grid, its spatial reference and that count
+        spatial_ref = arcpy.Describe(point_fc).spatialReference
+        points = arcpy.da.FeatureClassToNumPyArray(point_fc, ["SHAPE@XY", "ProfileNumber", "PointNumber"],
+                                                   null_value=0)
+        on_profile = (points["ProfileNumber"] >= 1) & (points["ProfileNumber"] <= len(line_ids))
+        orphans = int((~on_profile).sum())
+        points = points[on_profile]
+        xy = points["SHAPE@XY"]
+        origin = (float(np.floor(xy[:, 0].min())), float(np.floor(xy[:, 1].min()))) if len(points) else (0.0, 0.0)
+        grid = ProfileGrid(origin, profile_ids=line_ids, profile_lengths=line_lengths,
+                           col_ids=points["ProfileNumber"], col_numbers=points["PointNumber"],
+                           col_x=xy[:, 0] - origin[0], col_y=xy[:, 1] - origin[1])
+        return grid, spatial_ref, orphans
 
-            joined_fc = os.path.join(arcpy.env.scratchGDB, "joined_points_with_lines")
-            if arcpy.Exists(joined_fc):
-                arcpy.Delete_management(joined_fc)
 
-            arcpy.SpatialJoin_analysis(
-                target_features=point_fc,
-                join_features=line_fc,
-                out_feature_class=joined_fc,
-                join_operation="JOIN_ONE_TO_ONE",
-                join_type="KEEP_COMMON",
-                match_option="INTERSECT"
+    @staticmethod
+    def write_grid(grid, line_fc, point_fc, spatial_ref, collar_fields=None):
+        # Profiles are written only when line_fc is given; collar_fields adds per-collar columns.
+        # Returns the profile ObjectIDs
+        line_oids = None
+        if line_fc:
+            if arcpy.Exists(line_fc):
+                arcpy.Delete_management(line_fc)
+            arcpy.CreateFeatureclass_management(
+                out_path=os.path.dirname(line_fc),
+                out_name=os.path.basename(line_fc),
+                geometry_type="POLYLINE",
+                spatial_reference=spatial_ref
             )
+            arcpy.AddFields_management(line_fc, [["ProfileNumber", "LONG"], ["Zone", "LONG"]])
+
+            # Segments come grouped by profile, each group becomes one multipart profile
+            seg_ids = grid.seg_ids
+            bounds = np.concatenate([[0], np.flatnonzero(np.diff(seg_ids)) + 1, [seg_ids.size]])
+            coords = np.column_stack(grid.segment_world()).tolist()
+            with arcpy.da.InsertCursor(line_fc, ["SHAPE@", "ProfileNumber", "Zone"]) as cursor:
+                for profile_id, zone, start, end in zip(grid.profile_ids.tolist(), grid.profile_zone.tolist(),
+                                                        bounds[:-1], bounds[1:]):
+                    parts = arcpy.Array([arcpy.Array([arcpy.Point(x1, y1), arcpy.Point(x2, y2)])
+                                         for x1, y1, x2, y2 in coords[start:end]])
+                    cursor.insertRow([arcpy.Polyline(parts, spatial_ref), profile_id, zone])
+            line_oids = arcpy.da.FeatureClassToNumPyArray(line_fc, ["OID@"])["OID@"]
+
+        fields = [("XY", "<f8", 2), ("ProfileNumber", "<i4"), ("PointNumber", "<i4"), ("Zone", "<i4")]
+        relocated = bool(grid.col_shift.any())
+        if relocated:
+            fields.append(("Relocated", "<f8"))
+        if grid.col_merged is not None:
+            fields.append(("MergedFrom", grid.col_merged.dtype.str))
+        collar_fields = collar_fields or {}
+        fields.extend((name, values.dtype.str) for name, values in collar_fields.items())
+        collars = np.empty(grid.n_collars, dtype=fields)
+        collars["XY"][:, 0], collars["XY"][:, 1] = grid.collar_world()
+        collars["ProfileNumber"] = grid.col_ids
+        collars["PointNumber"] = grid.col_numbers
+        collars["Zone"] = grid.col_zone
+        if relocated:
+            collars["Relocated"] = grid.col_shift
+        if grid.col_merged is not None:
+            collars["MergedFrom"] = grid.col_merged
+        for name, values in collar_fields.items():
+            collars[name] = values
+        if arcpy.Exists(point_fc):
+            arcpy.Delete_management(point_fc)
+        arcpy.da.NumPyArrayToFeatureClass(collars, point_fc, ["XY"], spatial_ref)
+        return line_oids
 
-            with arcpy.da.UpdateCursor(point_fc, ["OID@", "ProfileNumber"]) as point_cursor:
-                id_map = {row[0]: row[1] for row in point_cursor}
 
-            with arcpy.da.SearchCursor(joined_fc, ["TARGET_FID", "ID"]) as join_cursor:
-                update_dict = {row[0]: row[1] for row in join_cursor}
+    @staticmethod
+    def diff_designs(grid, previous_layer, tolerance, spatial_ref, hole_length, removed_fc):
+        previous = arcpy.da.FeatureClassToNumPyArray(previous_layer, ["SHAPE@XY", "ProfileNumber", "PointNumber"],
+                                                     spatial_reference=spatial_ref, null_value=0)
+        old_x, old_y = grid.to_local(previous["SHAPE@XY"][:, 0], previous["SHAPE@XY"][:, 1])
+        old_change, new_change, shift = DesignDiff.compare(old_x, old_y, grid.col_x, grid.col_y, tolerance)
+        table = DesignDiff.per_profile(previous["ProfileNumber"], old_change, grid.col_ids, new_change, hole_length)
+
+        changes = DesignDiff.CHANGES
+        lost = previous[old_change == changes.index("removed")]
+        removed = np.empty(len(lost), dtype=[("XY", "<f8", 2), ("ProfileNumber", "<i4"), ("PointNumber", "<i4")])
+        removed["XY"] = lost["SHAPE@XY"]
+        removed["ProfileNumber"] = lost["ProfileNumber"]
+        removed["PointNumber"] = lost["PointNumber"]
+        if arcpy.Exists(removed_fc):
+            arcpy.Delete_management(removed_fc)
+        arcpy.da.NumPyArrayToFeatureClass(removed, removed_fc, ["XY"], spatial_ref)
+
+        totals = {name: int(np.sum(old_change == code) if name == "removed" else np.sum(new_change == code))
+                  for code, name in enumerate(changes)}
+        totals["meterage_change"] = float(np.sum(table["meterage_change"]))
+        arcpy.AddMessage(f"Design comparison (tolerance {tolerance:g} m): {totals['kept']} kept, "
+                         f"{totals['moved']} moved, {totals['added']} added, {totals['removed']} removed; "
+                         f"meterage change {totals['meterage_change']:+.0f}")
+        changed = np.flatnonzero(table["added"] + table["removed"] + table["moved"])
+        for index in changed[:50].tolist():
+            arcpy.AddMessage(f"  Profile {table['profile'][index]}: {table['old_collars'][index]} -> "
+                             f"{table['new_collars'][index]} collars (+{table['added'][index]} "
+                             f"-{table['removed'][index]} ~{table['moved'][index]}), "
+                             f"meterage {table['meterage_change'][index]:+.0f}")
+        if changed.size > 50:
+            arcpy.AddMessage(f"  ... {changed.size - 50} more changed profiles in the run log")
+
+        changed_profiles = {key: values[changed] for key, values in table.items()}
+        collar_fields = {"DesignChange": np.array(changes, dtype="<U8")[new_change], "ChangeShift": shift}
+        return collar_fields, totals, changed_profiles
+
+
+    @staticmethod
+    def plan_samples(grid, options, sequence_table, manifest_table):
+        # Samples follow the collars in ProfileNumber, PointNumber order
+        order = np.lexsort((grid.col_numbers, grid.col_ids))
+        plan = SamplePlan.plan(grid.n_collars, **options)
+        manifest = SamplePlan.manifest(plan)
+
+        source = plan["source"]
+        collar = np.where(source >= 0, order[np.maximum(source, 0)], -1)
+        id_length = max(int(plan["sample_id"].dtype.itemsize // 4), 1)
+        sequence = np.empty(source.size, dtype=[("SampleID", f"<U{id_length}"), ("Kind", "<U10"),
+                                                ("ParentID", f"<U{id_length}"), ("ProfileNumber", "<i4"),
+                                                ("PointNumber", "<i4"), ("Batch", "<i4"), ("BatchPosition", "<i4")])
+        sequence["SampleID"] = plan["sample_id"]
+        sequence["Kind"] = np.array(SamplePlan.KINDS)[plan["kind"]]
+        sequence["ParentID"] = plan["parent_id"]
+        sequence["ProfileNumber"] = np.where(collar >= 0, grid.col_ids[collar], 0)
+        sequence["PointNumber"] = np.where(collar >= 0, grid.col_numbers[collar], 0)
+        sequence["Batch"] = plan["batch"]
+        sequence["BatchPosition"] = plan["batch_position"]
+
+        batches = np.empty(manifest["batch"].size, dtype=[("Batch", "<i4"), ("FirstSample", f"<U{id_length}"),
+                                                          ("LastSample", f"<U{id_length}"), ("Size", "<i4"),
+                                                          ("Samples", "<i4"), ("Duplicates", "<i4"),
+                                                          ("Standards", "<i4"), ("Blanks", "<i4")])
+        for field, key in zip(batches.dtype.names, ("batch", "first_id", "last_id", "size", "sample", "duplicate",
+                                                    "standard", "blank")):
+            batches[field] = manifest[key]
+
+        for table, rows in ((sequence_table, sequence), (manifest_table, batches)):
+            if arcpy.Exists(table):
+                arcpy.Delete_management(table)
+            arcpy.da.NumPyArrayToTable(rows, table)
+
+        sample_id = np.empty(grid.n_collars, dtype=plan["routine_id"].dtype)
+        sample_id[order] = plan["routine_id"]
+        batch = np.empty(grid.n_collars, dtype=np.int32)
+        batch[order] = plan["routine_batch"]
+
+        summary = {kind: int(np.sum(plan["kind"] == code)) for code, kind in enumerate(SamplePlan.KINDS)}
+        summary["batches"] = int(manifest["batch"].size)
+        arcpy.AddMessage(f"Sample plan: {summary['sample']} samples, {summary['duplicate']} duplicates, "
+                         f"{summary['standard']} standards, {summary['blank']} blanks in {summary['batches']} "
+                         f"lab batches ({plan['sample_id'][0] if source.size else '-'} to "
+                         f"{plan['sample_id'][-1] if source.size else '-'})")
+        return {"SampleID": sample_id, "Batch": batch}, summary
+
 
-            with arcpy.da.UpdateCursor(point_fc, ["OID@", "ProfileNumber"]) as cursor:
+    @staticmethod
+    def process_in_bands(polygon_layer, spacing, azimuth, interval, utm_zone, band_size, resume,
+                         line_fc, point_fc, manifest_folder, custom_profiles=None):
+        fingerprint = BandManifest.fingerprint(
+            PolygonToProfiles.polygon_fingerprint(polygon_layer),
+            spacing=spacing, azimuth=azimuth, interval=interval, utm_zone=utm_zone, band_size=band_size,
+            custom_profiles=custom_profiles)
+        manifest_path = BandManifest.path(manifest_folder, fingerprint)
+
+        # Partial results live beside the manifest, keyed by the same fingerprint, so an interrupted
+        # run finds them again while runs with other inputs never touch them
+        band_gdb = os.path.splitext(manifest_path)[0] + ".gdb"
+        raw_lines = os.path.join(band_gdb, "profiles_raw")
+        clipped_lines = os.path.join(band_gdb, "profiles_clipped")
+        band_collars = os.path.join(band_gdb, "collars")
+        band_points = os.path.join("memory", "band_collars")
+        band_clipped = os.path.join("memory", "band_collars_clipped")
+
+        manifest = BandManifest.load(manifest_path, fingerprint) if resume else None
+        if manifest and not all(arcpy.Exists(fc) for fc in (raw_lines, clipped_lines, band_collars)):
+            manifest = None
+
+        if manifest:
+            arcpy.AddMessage(f"Resuming banded run: {manifest['completed']} of {len(manifest['bands'])} bands done")
+            # Drop collars appended by a band that was interrupted before its checkpoint
+            with arcpy.da.UpdateCursor(band_collars, ["OID@"],
+                                       f"PointNumber >= {manifest['next_point_number']}") as cursor:
                 for row in cursor:
-                    if row[0] in update_dict:
-                        row[1] = update_dict[row[0]]
-                        cursor.updateRow(row)
+                    cursor.deleteRow()
+        else:
+            if arcpy.Exists(band_gdb):
+                arcpy.Delete_management(band_gdb)
+            os.makedirs(manifest_folder, exist_ok=True)
+            arcpy.CreateFileGDB_management(manifest_folder, os.path.basename(band_gdb))
+            # Helpers raise here instead of reporting, so a failed step is never checkpointed as done
+            if custom_profiles:
+                PolygonToProfiles.copy_custom_profiles(custom_profiles, raw_lines, utm_zone, strict=True)
+            else:
+                PolygonToProfiles.generate_profiles(polygon_layer, spacing, azimuth, raw_lines, utm_zone,
+                                                    strict=True)
+            if arcpy.Exists(clipped_lines):
+                arcpy.Delete_management(clipped_lines)
+            arcpy.Clip_analysis(raw_lines, polygon_layer, clipped_lines)
+            PolygonToProfiles.create_collar_fc(band_collars, arcpy.Describe(raw_lines).spatialReference)
+
+            source_numbers = arcpy.da.FeatureClassToNumPyArray(clipped_lines, ["ProfileNumber"])["ProfileNumber"]
+            manifest = BandManifest.new(fingerprint, BandManifest.plan_bands(source_numbers, band_size))
+            BandManifest.save(manifest_path, manifest)
+
+        lines = arcpy.da.FeatureClassToNumPyArray(clipped_lines, ["OID@", "ProfileNumber", "SHAPE@LENGTH"])
+        line_ids = np.arange(1, len(lines) + 1, dtype=np.int32)
+
+        bands = manifest["bands"]
+        arcpy.SetProgressor("step", "Processing bands...", 0, len(bands), 1)
+        for band_index in range(manifest["completed"], len(bands)):
+            ProgressHelper.check_cancelled()
+            first, last = bands[band_index]
+            arcpy.SetProgressorLabel(f"Processing band {band_index + 1} of {len(bands)} "
+                                     f"(profiles {first}-{last})...")
+            arcpy.SetProgressorPosition(band_index)
+
+            PolygonToProfiles.generate_points(raw_lines, interval, band_points,
+                                              f"ProfileNumber >= {first} AND ProfileNumber <= {last}", strict=True)
+            arcpy.Clip_analysis(band_points, polygon_layer, band_clipped)
+            band_counts = CuttingHelper.number_points(band_clipped, lines["ProfileNumber"], line_ids,
+                                                      manifest["next_point_number"])
+            arcpy.Append_management(band_clipped, band_collars, "NO_TEST")
+            BandManifest.commit_band(manifest_path, manifest, band_counts)
+
+            for fc in (band_points, band_clipped):
+                arcpy.Delete_management(fc)
+
+        ProgressHelper.start(6, "Writing profile attributes...")
+        # The finished run is copied to this run's own outputs; copying keeps feature order
+        arcpy.CopyFeatures_management(clipped_lines, line_fc)
+        arcpy.CopyFeatures_management(band_collars, point_fc)
+        line_oids = arcpy.da.FeatureClassToNumPyArray(line_fc, ["OID@"])["OID@"]
+        collar_counts = BandManifest.collar_counts(manifest, len(line_ids))
+        BandManifest.remove(manifest_path)
+        arcpy.Delete_management(band_gdb)
+
+        return line_oids, line_ids, lines["SHAPE@LENGTH"], collar_counts
+
+
+    @staticmethod
+    def polygon_fingerprint(polygon_layer):
+        digest = hashlib.sha1()
+        with arcpy.da.SearchCursor(polygon_layer, ["SHAPE@WKB"]) as cursor:
+            for row in cursor:
+                digest.update(bytes(row[0]))
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def merge_collars(grid, adjacent_layers, tolerance, spatial_ref):
+        x, y = [grid.col_x], [grid.col_y]
+        for layer in adjacent_layers:
+            adjacent = arcpy.da.FeatureClassToNumPyArray(layer.strip("'"), ["SHAPE@XY"],
+                                                         spatial_reference=spatial_ref)
+            adjacent_x, adjacent_y = grid.to_local(adjacent["SHAPE@XY"][:, 0], adjacent["SHAPE@XY"][:, 1])
+            x.append(adjacent_x)
+            y.append(adjacent_y)
+        n_own = grid.n_collars
+        fixed = np.arange(sum(len(part) for part in x)) >= n_own
+
+        keep, representative, merged_x, merged_y = HashGrid.merge(np.concatenate(x), np.concatenate(y),
+                                                                  tolerance, fixed)
+        keep, representative = keep[:n_own], representative[:n_own]
+
+        # Provenance: each kept collar lists the ProfileNumber:PointNumber of collars merged into it
+        dropped = np.flatnonzero(~keep)
+        provenance = {}
+        for index in dropped.tolist():
+            if representative[index] < n_own:
+                provenance.setdefault(int(representative[index]), []).append(
+                    f"{grid.col_ids[index]}:{grid.col_numbers[index]}")
+        # Sized to the longest list (at most 255 characters, the text field limit), not a fixed 255 per collar
+        texts = {index: ";".join(sources)[:255] for index, sources in provenance.items()}
+        width = max((len(text) for text in texts.values()), default=1)
+        merged_from = np.full(n_own, "", dtype=f"<U{width}")
+        for index, text in texts.items():
+            merged_from[index] = text
+
+        merged_into_adjacent = int(np.sum(representative[dropped] >= n_own))
+        arcpy.AddMessage(f"Collar merge: {len(dropped)} collars removed "
+                         f"({merged_into_adjacent} already planned in adjacent blocks)")
+        return grid.replace_collars(keep, col_x=merged_x[:n_own][keep], col_y=merged_y[:n_own][keep],
+                                    col_merged=merged_from[keep])
+
+
+    @staticmethod
+    def relocate_collars(grid, access_raster, max_slope, max_distance, azimuth, spatial_ref, polygon_layer):
+        raster = arcpy.Raster(access_raster)
+        if raster.spatialReference.factoryCode != spatial_ref.factoryCode:
+            # The raster is brought to the collars' coordinate system once, so the grid never leaves memory
+            projected = os.path.join(arcpy.env.scratchGDB, "access_projected")
+            arcpy.ProjectRaster_management(raster, projected, spatial_ref)
+            raster = arcpy.Raster(projected)
+        values = arcpy.RasterToNumPyArray(raster).astype(np.float64)
+        if raster.noDataValue is not None:
+            values[values == raster.noDataValue] = np.nan
+        # The mask is placed in the grid's local coordinates
+        x_min, y_max = grid.to_local(raster.extent.XMin, raster.extent.YMax)
+        mask = AccessMask.from_raster_array(values, x_min, y_max, raster.meanCellWidth, raster.meanCellHeight,
+                                            max_slope)
+
+        x, y = grid.col_x, grid.col_y
+        dir_x, dir_y = AccessMask.profile_directions(x, y, grid.col_ids, grid.col_numbers, azimuth)
+        new_x, new_y, dropped, unknown = mask.relocate(x, y, dir_x, dir_y, max_distance)
+        if unknown.any():
+            arcpy.AddWarning(f"Access check: {int(unknown.sum())} collars lie outside the access raster and were "
+                             f"kept unchecked")
+
+        # A move along the profile can leave the polygon; such collars are dropped as well
+        shift = np.hypot(new_x - x, new_y - y)
+        moved = np.flatnonzero((shift > 0) & ~dropped)
+        rings = [ring for _, shape_rings, _ in PolygonToProfiles.read_rings(polygon_layer, (), spatial_ref)
+                 for ring in shape_rings]
+        x1, y1, x2, y2 = ProfileEngine.polygon_edges(rings)
+        edges = grid.to_local(x1, y1) + grid.to_local(x2, y2)
+        left = moved[~ProfileEngine.contains(edges, new_x[moved], new_y[moved])]
+        dropped[left] = True
+        arcpy.AddMessage(f"Access check: {moved.size - left.size} collars relocated, {int(dropped.sum())} dropped "
+                         f"({left.size} would have left the polygon)")
+        keep = ~dropped
+        return grid.replace_collars(keep, col_x=new_x[keep], col_y=new_y[keep],
+                                    col_shift=grid.col_shift[keep] + shift[keep])
+
+
+    @staticmethod
+    def generate_traces(grid, output_fc, spatial_ref, dip, azimuth, hole_length, survey_interval=None):
+        # Collars have no elevation here, so depths below the collar are negative Z
+        collar_x, collar_y = grid.collar_world()
+        hole, _, x, y, z = HoleTrace.stations(collar_x, collar_y, 0.0, dip, azimuth, hole_length,
+                                              survey_interval)
+        end_x, end_y, end_z = HoleTrace.end_points(0.0, 0.0, 0.0, dip, azimuth, hole_length)
+
+        if arcpy.Exists(output_fc):
+            arcpy.Delete_management(output_fc)
+        arcpy.CreateFeatureclass_management(
+            out_path=os.path.dirname(output_fc),
+            out_name=os.path.basename(output_fc),
+            geometry_type="POLYLINE",
+            has_z="ENABLED",
+            spatial_reference=spatial_ref
+        )
+        arcpy.AddFields_management(output_fc, [["ProfileNumber", "LONG"], ["PointNumber", "LONG"],
+                                               ["Dip", "DOUBLE"], ["Azimuth", "DOUBLE"],
+                                               ["HoleLength", "DOUBLE"], ["VerticalDepth", "DOUBLE"]])
+
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(hole)) + 1, [hole.size]]).tolist()
+        coords = np.column_stack([x, y, z]).tolist()
+        vertical = float(-end_z)
+        with arcpy.da.InsertCursor(output_fc, ["SHAPE@", "ProfileNumber", "PointNumber", "Dip", "Azimuth",
+                                               "HoleLength", "VerticalDepth"]) as cursor:
+            for index, (profile_num, point_num) in enumerate(zip(grid.col_ids.tolist(), grid.col_numbers.tolist())):
+                ProgressHelper.report(index + 1, "Writing hole traces")
+                trace = arcpy.Array([arcpy.Point(*xyz) for xyz in coords[bounds[index]:bounds[index + 1]]])
+                cursor.insertRow([arcpy.Polyline(trace, spatial_ref, True), profile_num, point_num,
+                                  dip, azimuth, hole_length, vertical])
+
+        arcpy.AddMessage(f"Hole traces: {grid.n_collars} holes at dip {dip}, azimuth {azimuth}, "
+                         f"{hole_length:.1f} m along hole ({vertical:.1f} m vertical, "
+                         f"{float(np.hypot(end_x, end_y)):.1f} m horizontal offset)")
+
+
+    @staticmethod
+    def export_tiles(line_fc, point_fc, folder, min_zoom, max_zoom):
+        # Tablets work in Web Mercator, so both layers are projected on read and tiled with numpy only
+        mercator = arcpy.SpatialReference(3857)
+        collars = arcpy.da.FeatureClassToNumPyArray(point_fc, ["SHAPE@XY", "ProfileNumber"],
+                                                    spatial_reference=mercator, null_value=0)
+        segments = []
+        with arcpy.da.SearchCursor(line_fc, ["SHAPE@", "ProfileNumber"], spatial_reference=mercator) as cursor:
+            for shape, profile_id in cursor:
+                if shape is None:
+                    continue
+                for part in shape:
+                    vertices = [(point.X, point.Y) for point in part if point]
+                    for (x1, y1), (x2, y2) in zip(vertices[:-1], vertices[1:]):
+                        segments.append((x1, y1, x2, y2, profile_id or 0))
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 5)
+
+        tile_folder = os.path.join(folder, "depthsum_tiles")
+        if os.path.exists(tile_folder):
+            shutil.rmtree(tile_folder)
+        metadata = TilePyramid.build(tile_folder, collars["SHAPE@XY"][:, 0], collars["SHAPE@XY"][:, 1],
+                                     collars["ProfileNumber"], tuple(segments.T), min_zoom, max_zoom,
+                                     os.cpu_count())
+        n_tiles = sum(metadata["tiles"].values())
+        arcpy.AddMessage(f"Tile pyramid: {n_tiles} tiles at zooms {min_zoom}-{max_zoom} in {tile_folder}")
+        return {"folder": tile_folder, "tiles": n_tiles, "min_zoom": min_zoom, "max_zoom": max_zoom}
+
 
-            arcpy.Delete_management(joined_fc)
+    @staticmethod
+    def analyse_coverage(polygon_layer, grid, spatial_ref, cell, gap_distance, window, distance_raster,
+                         density_raster):
+        rings = [ring for _, shape_rings, _ in PolygonToProfiles.read_rings(polygon_layer, (), spatial_ref)
+                 for ring in shape_rings]
+        x, y = grid.collar_world()
+        raster, rasters, summary = CoverageRaster.analyse(rings, x, y, cell, gap_distance, window)
+        if raster.cell > cell:
+            arcpy.AddWarning(f"Coverage cell size raised to {raster.cell:.1f} m to keep the raster within "
+                             f"{CoverageRaster.MAX_CELLS} cells")
+
+        lower_left = arcpy.Point(raster.x_min, raster.y_max - raster.n_rows * raster.cell)
+        for path, values in ((distance_raster, rasters["distance"]), (density_raster, rasters["density"])):
+            if arcpy.Exists(path):
+                arcpy.Delete_management(path)
+            arcpy.NumPyArrayToRaster(values, lower_left, raster.cell, raster.cell,
+                                     CoverageRaster.NODATA).save(path)
+            arcpy.DefineProjection_management(path, spatial_ref)
+
+        arcpy.AddMessage(f"Coverage ({summary['cell']:.1f} m cells): {summary['holes_per_km2']:.1f} holes per km² "
+                         f"over {summary['area_km2']:.2f} km²; distance to nearest collar P50 "
+                         f"{summary['distance_p50']:.1f} m, P90 {summary['distance_p90']:.1f} m, max "
+                         f"{summary['distance_max']:.1f} m")
+        arcpy.AddMessage(f"  Gaps farther than {gap_distance} m from any collar: {summary['gap_area_km2']:.3f} km² "
+                         f"({summary['gap_fraction'] * 100:.1f}% of the polygon)")
+        return summary
 
-            CuttingHelper.assign_sequential_id(point_fc, "PointNumber")
+
+    @staticmethod
+    def add_depths(collar_counts, avg_depth):
+        try:
+            # Meterage comes from the collars actually placed on each profile
+            depths = np.asarray(collar_counts, dtype=np.int64) * float(avg_depth)
+            total_depth = int(depths.sum())
+            arcpy.AddMessage(f"Total meterage of planned drilling campaign: {total_depth}")
+            return depths
 
         except Exception as e:
-            arcpy.AddError("Cutting by polygon error: " + str(e))
+            arcpy.AddError(f"Error in add_depths: {e}")
 
 
     @staticmethod
-    def add_depths(line_layer, interval, avg_depth, field, log_folder):
+    def simulate_meterage(n_holes, avg_depth, distribution, depth_sd, empirical_table, empirical_field,
+                          trials, parallel, seed=None):
         try:
-            if not os.path.exists(log_folder):
-                os.makedirs(log_folder)
+            empirical = None
+            if distribution == "Empirical":
+                empirical = arcpy.da.TableToNumPyArray(empirical_table, [empirical_field],
+                                                       skip_nulls=True)[empirical_field]
+
+            if seed is None:
+                seed = MeterageSimulator.new_seed()
+            workers = os.cpu_count() if parallel else 1
+            totals = MeterageSimulator.simulate(n_holes, trials, distribution, avg_depth, depth_sd,
+                                                empirical, workers, seed)
+            stats = MeterageSimulator.summarize(totals)
+            stats["seed"] = int(seed)
+
+            arcpy.AddMessage(f"Meterage simulation ({distribution}, {stats['trials']} trials, {n_holes} holes, "
+                             f"seed {seed}):")
+            arcpy.AddMessage(f"  P10: {stats['P10']:.1f}  P50: {stats['P50']:.1f}  P90: {stats['P90']:.1f}")
+            arcpy.AddMessage(f"  Mean: {stats['mean']:.1f}  Std: {stats['std']:.1f}")
+            return stats
 
-            existing_fields = [f.name for f in arcpy.ListFields(line_layer)]
-            if field not in existing_fields:
-                arcpy.AddField_management(line_layer, field, "DOUBLE")
+        except Exception as e:
+            arcpy.AddError(f"Error in simulate_meterage: {e}")
 
-            log_file = os.path.join(log_folder, f"depth_log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-            with arcpy.da.UpdateCursor(line_layer, ["SHAPE@LENGTH", field]) as cursor, open(log_file, "w") as file:
-                total_depth = 0
-                for row in cursor:
-                    length = row[0]
-                    n_points = int(length / interval) + 1
-                    depth = n_points * avg_depth
-                    row[1] = depth
-                    cursor.updateRow(row)
-                    total_depth += depth
-                    file.write(f"{length:.2f} -> {depth}\n")
-                file.write(f"Total depth: {total_depth}")
-                arcpy.AddMessage(f"Total meterage of planned drilling campaign: {total_depth}")
+
+    @staticmethod
+    def catalog_run(run_log, polygon_layer):
+        try:
+            extent = arcpy.Describe(polygon_layer).extent
+            bounds = (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+            wkid = extent.spatialReference.factoryCode
+
+            with RunCatalog(RunCatalog.default_path(run_log.log_folder)) as catalog:
+                previous = catalog.best_design(bounds, wkid, run_log.polygon_hash)
+                if previous:
+                    arcpy.AddMessage(f"Closest previous design: run {previous['run_id']} "
+                                     f"(spacing {previous['spacing']}, azimuth {previous['azimuth']}, "
+                                     f"interval {previous['point_interval']}, "
+                                     f"meterage {previous['total_meterage']})")
+                catalog.record(run_log.header(), run_log.profiles, bounds, wkid)
 
         except Exception as e:
-            arcpy.AddError(f"Error in add_depths: {e}")
+            arcpy.AddWarning(f"Run was not added to the catalog: {e}")
 
 
     @staticmethod
-    def add_layer_to_map(layer_path, layer_name):
+    def add_layers_to_map(layers):
         try:
             aprx = arcpy.mp.ArcGISProject("CURRENT")
             active_map = aprx.activeMap
-            if active_map:
-                active_map.addDataFromPath(layer_path)
+            if not active_map:
+                return
         except Exception as e:
-            arcpy.AddWarning(f"Layer {layer_name} was not added to map {e}")
+            arcpy.AddWarning(f"Layers were not added to map {e}")
+            return
+
+        for layer_path, layer_name in layers:
+            try:
+                active_map.addDataFromPath(layer_path)
+            except Exception as e:
+                arcpy.AddWarning(f"Layer {layer_name} was not added to map {e}")
+
+
+class ToolCancelled(Exception):
+    pass
+
+
+class ProgressHelper:
+    # Cancellation is polled and the label refreshed once per this many profiles
+    REPORT_EVERY = 500
+
+    @staticmethod
+    def start(n_stages, label):
+        arcpy.SetProgressor("step", label, 0, n_stages, 1)
+
+    @staticmethod
+    def stage(position, label):
+        ProgressHelper.check_cancelled()
+        arcpy.SetProgressorLabel(label)
+        arcpy.SetProgressorPosition(position)
+
+    @staticmethod
+    def report(count, label):
+        if count % ProgressHelper.REPORT_EVERY == 0:
+            ProgressHelper.check_cancelled()
+            arcpy.SetProgressorLabel(f"{label}: {count} profiles...")
+
+    @staticmethod
+    def check_cancelled():
+        if arcpy.env.isCancelled:
+            raise ToolCancelled("Tool execution was cancelled")
+
+
+class RunWorkspace:
+    # Every run writes its outputs to its own geodatabase and its intermediates to a private
+    # temporary one, so concurrent runs from the same toolbox never share a dataset or a lock
+    def __init__(self, toolbox_folder, run_id):
+        self.results_folder = os.path.join(toolbox_folder, "results")
+        os.makedirs(self.results_folder, exist_ok=True)
+        self.output_gdb = os.path.join(self.results_folder, f"run_{run_id}.gdb")
+        arcpy.CreateFileGDB_management(self.results_folder, os.path.basename(self.output_gdb))
+
+        self.temp_folder = tempfile.mkdtemp(prefix="depthsum_")
+        self.temp_gdb = os.path.join(self.temp_folder, "scratch.gdb")
+        arcpy.CreateFileGDB_management(self.temp_folder, "scratch.gdb")
+        self._previous_scratch = arcpy.env.scratchWorkspace
+        arcpy.env.scratchWorkspace = self.temp_gdb
+
+    def cleanup(self):
+        arcpy.env.scratchWorkspace = self._previous_scratch
+        try:
+            arcpy.Delete_management(self.temp_gdb)
+        except Exception:
+            pass
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+        if os.path.exists(self.temp_folder):
+            arcpy.AddWarning(f"Temporary workspace was not deleted: {self.temp_folder}")
+
+
+class PreviewHelper:
+    # Polygon edges read for the parameter-dialog estimate, keyed by layer, UTM zone and extent
+    CACHE = {}
+
+    @staticmethod
+    def polygon(polygon_layer, utm_zone):
+        describe = arcpy.Describe(polygon_layer)
+        spatial_ref = None
+        if describe.spatialReference.type == "Geographic":
+            if not utm_zone:
+                return None
+            spatial_ref = arcpy.SpatialReference(32600 + int(utm_zone))
+        extent = describe.extent
+        key = (polygon_layer, utm_zone if spatial_ref else None,
+               extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+        if key not in PreviewHelper.CACHE:
+            # The geometry is read once per layer; further keystrokes only rotate the cached edges
+            polygons = PolygonToProfiles.read_rings(polygon_layer, spatial_ref=spatial_ref)
+            if not polygons:
+                return None
+            centroid = polygons[0][0].centroid
+            edges = ProfileEngine.polygon_edges([ring for _, rings, _ in polygons for ring in rings])
+            width = float(max(edges[0].max(), edges[2].max()) - min(edges[0].min(), edges[2].min()))
+            PreviewHelper.CACHE.clear()
+            PreviewHelper.CACHE[key] = (edges, (centroid.X, centroid.Y), width)
+        return PreviewHelper.CACHE[key]
+
+    @staticmethod
+    def estimate(parameters):
+        params = {parameter.name: parameter for parameter in parameters}
+        if any(not params[name].value or params[name].hasError()
+               for name in ("in_polygons", "profile_spacing", "point_interval")):
+            return None
+        if params["azimuth"].value is None or params["custom_profiles"].value:
+            return None
+        try:
+            polygon = PreviewHelper.polygon(params["in_polygons"].valueAsText, params["utm_zone"].value)
+            if polygon is None:
+                return None
+            edges, origin, width = polygon
+            return ProfileEngine.estimate_grid(edges, origin, width, params["profile_spacing"].value,
+                                               params["azimuth"].value, params["point_interval"].value)
+        except Exception:
+            # The preview is advisory; validation never fails because of it
+            return None
 
 
 class CuttingHelper:
     @staticmethod
-    def assign_sequential_id(fc, field_name):
-        # Добавить поле, если его ещё нет
-        existing_fields = [f.name for f in arcpy.ListFields(fc)]
-        if field_name not in existing_fields:
-            arcpy.AddField_management(fc, field_name, "LONG")
+    def number_points(point_fc, line_numbers, line_ids, first_point_number):
+        # Map creation-time ProfileNumber to the clipped profile ID and number collars in order
+        points = arcpy.da.FeatureClassToNumPyArray(point_fc, ["OID@", "ProfileNumber"])
+        order = np.argsort(line_numbers, kind="stable")
+        source_numbers = line_numbers[order]
+        pos = np.minimum(np.searchsorted(source_numbers, points["ProfileNumber"]), len(line_numbers) - 1)
+        matched = source_numbers[pos] == points["ProfileNumber"]
+        profile_ids = np.where(matched, line_ids[order][pos], 0)
+
+        CuttingHelper.write_fields(point_fc, points["OID@"], {
+            "ProfileNumber": profile_ids,
+            "PointNumber": np.arange(first_point_number, first_point_number + len(points), dtype=np.int32),
+        })
+        return np.bincount(profile_ids, minlength=len(line_ids) + 1)[1:]
 
-        # Присвоить значения ID по порядку
-        with arcpy.da.UpdateCursor(fc, [field_name]) as cursor:
-            counter = 1
+    @staticmethod
+    def write_fields(fc, oids, columns, field_types=None):
+        # Добавить недостающие поля одним вызовом; field_types задаёт тип поля явно
+        field_types = field_types or {}
+        existing_fields = [f.name for f in arcpy.ListFields(fc)]
+        new_fields = [[name, field_types.get(name) or
+                       ("LONG" if np.asarray(values).dtype.kind in "iub" else "DOUBLE")]
+                      for name, values in columns.items() if name not in existing_fields]
+        if new_fields:
+            arcpy.AddFields_management(fc, new_fields)
+
+        # Записать все столбцы за один проход по таблице
+        names = list(columns)
+        rows = dict(zip(np.asarray(oids).tolist(),
+                        zip(*[np.asarray(columns[name]).tolist() for name in names])))
+        with arcpy.da.UpdateCursor(fc, ["OID@"] + names) as cursor:
             for row in cursor:
-                row[0] = counter
-                cursor.updateRow(row)
-                counter += 1
\ No newline at end of file
+                values = rows.get(row[0])
+                if values is not None:
+                    cursor.updateRow([row[0]] + list(values))
\ No newline at end of file
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+TOOLBOX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "depthsum4.py")
+
+# Modules that must stay unloaded until execute; the numpy-only engine may load for the preview
+DEFERRED_MODULES = ["scipy", "depthsum_simulation", "depthsum_checkpoint", "depthsum_runlog",
+                    "depthsum_catalog", "depthsum_traces", "depthsum_diff", "depthsum_samples",
+                    "depthsum_tiles", "depthsum_coverage", "depthsum_pool"]
+
+# Runs in a fresh interpreter so every sample pays the real import cost. Validation is timed twice: with
+# the dialog empty, as it opens, and with a polygon, spacing, azimuth, interval and depth filled in, where
+# the first call pays the live preview's engine import and geometry read and later calls hit its cache
+CHILD = r"""
+import importlib.util, json, math, os, sys, tempfile, time
+from importlib.machinery import SourceFileLoader
+
+started = time.perf_counter()
+import arcpy
+arcpy_loaded = time.perf_counter()
+
+loader = SourceFileLoader("depthsum_toolbox", sys.argv[1])
+module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+loader.exec_module(module)
+tool = module.Toolbox().tools[0]()
+toolbox_loaded = time.perf_counter()
+
+params = tool.getParameterInfo()
+parameters_built = time.perf_counter()
+
+validations = int(sys.argv[2])
+for _ in range(validations):
+    tool.updateParameters(params)
+    tool.updateMessages(params)
+validated = time.perf_counter()
+
+# An ellipse block with the requested vertex count, written before the populated timings start
+folder = tempfile.mkdtemp(prefix="depthsum_benchmark_")
+arcpy.CreateFileGDB_management(folder, "bench.gdb")
+polygon_fc = os.path.join(folder, "bench.gdb", "block")
+arcpy.CreateFeatureclass_management(os.path.dirname(polygon_fc), "block", "POLYGON",
+                                    spatial_reference=arcpy.SpatialReference(32635))
+n = int(sys.argv[4])
+ring = [[500000 + 3000 * math.cos(-2 * math.pi * k / n), 6000000 + 2000 * math.sin(-2 * math.pi * k / n)]
+        for k in range(n)]
+shape = arcpy.AsShape({"rings": [ring + ring[:1]], "spatialReference": {"wkid": 32635}}, True)
+with arcpy.da.InsertCursor(polygon_fc, ["SHAPE@"]) as cursor:
+    cursor.insertRow([shape])
+by_name = {parameter.name: parameter for parameter in params}
+for name, value in (("in_polygons", polygon_fc), ("profile_spacing", 100), ("azimuth", 30),
+                    ("point_interval", 25), ("depth_value", 50)):
+    by_name[name].value = value
+
+cold_started = time.perf_counter()
+tool.updateParameters(params)
+tool.updateMessages(params)
+cold = time.perf_counter()
+for _ in range(validations):
+    tool.updateParameters(params)
+    tool.updateMessages(params)
+cached = time.perf_counter()
+
+print(json.dumps({
+    "import_arcpy_ms": (arcpy_loaded - started) * 1000.0,
+    "load_toolbox_ms": (toolbox_loaded - arcpy_loaded) * 1000.0,
+    "parameter_info_ms": (parameters_built - toolbox_loaded) * 1000.0,
+    "validate_ms": (validated - parameters_built) * 1000.0 / max(validations, 1),
+    "preview_cold_ms": (cold - cold_started) * 1000.0,
+    "preview_cached_ms": (cached - cold) * 1000.0 / max(validations, 1),
+    "preview_message": by_name["in_polygons"].message,
+    "loaded": [name for name in json.loads(sys.argv[3]) if name in sys.modules],
+}))
+"""
+
+
+def run_once(validations, vertices):
+    output = subprocess.run([sys.executable, "-c", CHILD, TOOLBOX, str(validations), json.dumps(DEFERRED_MODULES),
+                             str(vertices)], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure toolbox open and parameter validation latency")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--validations", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    parser.add_argument("--vertices", type=int, default=20000, help="vertices of the block used for the preview")
+    parser.add_argument("--preview-budget-ms", type=float, default=100.0,
+                        help="limit for the first populated validation; cached validations must stay below it too")
+    args = parser.parse_args()
+
+    samples = [run_once(args.validations, args.vertices) for _ in range(args.repeat)]
+    report = {key: statistics.median(sample[key] for sample in samples)
+              for key in ("import_arcpy_ms", "load_toolbox_ms", "parameter_info_ms", "validate_ms",
+                          "preview_cold_ms", "preview_cached_ms")}
+    # arcpy is already loaded inside Pro, so the budget covers the toolbox's own work only
+    report["tool_open_ms"] = report["load_toolbox_ms"] + report["parameter_info_ms"] + report["validate_ms"]
+    report["deferred_modules_loaded"] = sorted({name for sample in samples for name in sample["loaded"]})
+    report["preview_message"] = samples[-1]["preview_message"]
+
+    for key, value in report.items():
+        print(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}")
+
+    # A preview that never appears is a failure too, not a fast validation
+    ok = (report["tool_open_ms"] <= args.budget_ms and not report["deferred_modules_loaded"]
+          and report["preview_cold_ms"] <= args.preview_budget_ms
+          and report["preview_cached_ms"] <= args.preview_budget_ms
+          and report["preview_message"].startswith("Estimate:"))
+    print("PASS" if ok else f"FAIL (budget {args.budget_ms:.0f} ms, preview {args.preview_budget_ms:.0f} ms)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sqlite3
+
+
+CATALOG_NAME = "depthsum_catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT UNIQUE NOT NULL,
+    timestamp TEXT NOT NULL,
+    polygon_hash TEXT,
+    wkid INTEGER,
+    xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+    spacing REAL,
+    azimuth REAL,
+    point_interval REAL,
+    avg_depth REAL,
+    n_profiles INTEGER,
+    n_collars INTEGER,
+    total_meterage REAL,
+    params TEXT,
+    summary TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_polygon ON runs (polygon_hash);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE TABLE IF NOT EXISTS profiles (
+    run INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    profile_id INTEGER NOT NULL,
+    length REAL,
+    meterage REAL,
+    PRIMARY KEY (run, profile_id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS run_extents USING rtree (id, xmin, xmax, ymin, ymax);
+"""
+
+
+class RunCatalog:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def default_path(folder):
+        return os.path.join(folder, CATALOG_NAME)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, header, profiles=None, extent=None, wkid=None):
+        params = header.get("params", {})
+        summary = header.get("summary", {})
+        xmin, ymin, xmax, ymax = extent if extent else (None, None, None, None)
+        with self.connection:
+            # A re-recorded run replaces its row, its profiles and its extent
+            replaced = self.connection.execute("SELECT id FROM runs WHERE run_id = ?", (header["run_id"],)).fetchall()
+            for (old_run,) in replaced:
+                self.connection.execute("DELETE FROM run_extents WHERE id = ?", (old_run,))
+                self.connection.execute("DELETE FROM profiles WHERE run = ?", (old_run,))
+                self.connection.execute("DELETE FROM runs WHERE id = ?", (old_run,))
+            cursor = self.connection.execute(
+                "INSERT INTO runs (run_id, timestamp, polygon_hash, wkid, xmin, ymin, xmax, ymax, "
+                "spacing, azimuth, point_interval, avg_depth, n_profiles, n_collars, total_meterage, "
+                "params, summary, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (header["run_id"], header["timestamp"], header.get("polygon_hash"), wkid,
+                 xmin, ymin, xmax, ymax,
+                 params.get("spacing"), params.get("azimuth"), params.get("point_interval"),
+                 params.get("avg_depth"), summary.get("profiles"), summary.get("collars"),
+                 summary.get("total_meterage"),
+                 json.dumps(params, default=str), json.dumps(summary, default=str),
+                 json.dumps(header.get("timings", {}))))
+            run = cursor.lastrowid
+            if extent:
+                self.connection.execute("INSERT OR REPLACE INTO run_extents VALUES (?, ?, ?, ?, ?)",
+                                        (run, xmin, xmax, ymin, ymax))
+            if profiles:
+                meterage = profiles.get("meterage") or [None] * len(profiles["id"])
+                self.connection.executemany(
+                    "INSERT INTO profiles (run, profile_id, length, meterage) VALUES (?, ?, ?, ?)",
+                    [(run, pid, length, depth)
+                     for pid, length, depth in zip(profiles["id"], profiles["length"], meterage)])
+        return run
+
+    def find_by_polygon(self, polygon_hash, limit=20):
+        rows = self.connection.execute(
+            "SELECT * FROM runs WHERE polygon_hash = ? ORDER BY timestamp DESC LIMIT ?",
+            (polygon_hash, limit))
+        return [dict(row) for row in rows]
+
+    def find_overlapping(self, extent, wkid=None, since=None, limit=20):
+        # Candidates come from the R*Tree, then rank by intersection-over-union of the extents
+        xmin, ymin, xmax, ymax = extent
+        sql = ("SELECT runs.*, "
+               "(MIN(runs.xmax, :xmax) - MAX(runs.xmin, :xmin)) * (MIN(runs.ymax, :ymax) - MAX(runs.ymin, :ymin)) "
+               "AS overlap_area, (runs.xmax - runs.xmin) * (runs.ymax - runs.ymin) AS run_area "
+               "FROM run_extents JOIN runs ON runs.id = run_extents.id "
+               "WHERE run_extents.xmin <= :xmax AND run_extents.xmax >= :xmin "
+               "AND run_extents.ymin <= :ymax AND run_extents.ymax >= :ymin")
+        args = {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax}
+        if wkid is not None:
+            sql += " AND runs.wkid = :wkid"
+            args["wkid"] = wkid
+        if since:
+            sql += " AND runs.timestamp >= :since"
+            args["since"] = since
+
+        area = max((xmax - xmin) * (ymax - ymin), 0.0)
+        results = []
+        for row in self.connection.execute(sql, args):
+            run = dict(row)
+            union = area + run.pop("run_area") - run["overlap_area"]
+            run["overlap"] = run["overlap_area"] / union if union > 0 else 0.0
+            results.append(run)
+        results.sort(key=lambda run: run["timestamp"], reverse=True)
+        results.sort(key=lambda run: run["overlap"], reverse=True)
+        return results[:limit]
+
+    def best_design(self, extent, wkid=None, polygon_hash=None):
+        if polygon_hash:
+            exact = self.find_by_polygon(polygon_hash, limit=1)
+            if exact:
+                return exact[0]
+        overlapping = self.find_overlapping(extent, wkid, limit=1)
+        return overlapping[0] if overlapping else None
+
+    def profiles(self, run):
+        rows = self.connection.execute(
+            "SELECT profile_id, length, meterage FROM profiles WHERE run = ? ORDER BY profile_id", (run,))
+        return [dict(row) for row in rows]
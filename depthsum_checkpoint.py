@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class BandManifest:
+    @staticmethod
+    def fingerprint(polygon_hash, **params):
+        payload = json.dumps({"polygon": polygon_hash, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def path(folder, fingerprint):
+        return os.path.join(folder, f"bands_{fingerprint[:16]}.json")
+
+    @staticmethod
+    def plan_bands(profile_numbers, band_size):
+        # Consecutive runs of band_size profiles, as inclusive [first, last] ProfileNumber ranges
+        numbers = np.unique(np.asarray(profile_numbers, dtype=np.int64))
+        band_size = max(int(band_size), 1)
+        return [[int(numbers[i]), int(numbers[min(i + band_size, numbers.size) - 1])]
+                for i in range(0, numbers.size, band_size)]
+
+    @staticmethod
+    def new(fingerprint, bands):
+        return {
+            "fingerprint": fingerprint,
+            "bands": bands,
+            "completed": 0,
+            "next_point_number": 1,
+            "collar_counts": {},
+        }
+
+    @staticmethod
+    def load(path, fingerprint):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("fingerprint") != fingerprint:
+            return None
+        return manifest
+
+    @staticmethod
+    def save(path, manifest):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # Write-then-rename so an interrupted save never leaves a truncated manifest
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def commit_band(path, manifest, collar_counts):
+        # collar_counts holds per-profile collar counts of this band, indexed by profile ID - 1
+        counts = manifest["collar_counts"]
+        for index in np.flatnonzero(collar_counts).tolist():
+            key = str(index + 1)
+            counts[key] = counts.get(key, 0) + int(collar_counts[index])
+        manifest["completed"] += 1
+        manifest["next_point_number"] += int(np.sum(collar_counts))
+        BandManifest.save(path, manifest)
+
+    @staticmethod
+    def collar_counts(manifest, n_profiles):
+        counts = np.zeros(n_profiles, dtype=np.int64)
+        for key, count in manifest["collar_counts"].items():
+            counts[int(key) - 1] = count
+        return counts
+
+    @staticmethod
+    def remove(path):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from depthsum_engine import ProfileEngine
+
+
+class CoverageRaster:
+    # Upper bound on raster cells; finer requests are coarsened to stay within it
+    MAX_CELLS = 64 * 1024 * 1024
+    # Upper bound on row x edge crossings tested at once while filling the polygon mask
+    CHUNK_CELLS = 4 * 1024 * 1024
+    NODATA = -1.0
+
+    def __init__(self, x_min, y_max, cell, n_rows, n_cols):
+        # Row 0 at y_max, as in AccessMask; transform is the GDAL-style geotransform
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.cell = float(cell)
+        self.n_rows = int(n_rows)
+        self.n_cols = int(n_cols)
+        self.transform = (self.x_min, self.cell, 0.0, self.y_max, 0.0, -self.cell)
+
+    @staticmethod
+    def covering(edges, cell, margin=0.0):
+        # Raster over the polygon extent plus margin, coarsened if it would exceed MAX_CELLS
+        x1, y1, x2, y2 = edges
+        x_min = min(float(x1.min()), float(x2.min())) - margin
+        x_max = max(float(x1.max()), float(x2.max())) + margin
+        y_min = min(float(y1.min()), float(y2.min())) - margin
+        y_max = max(float(y1.max()), float(y2.max())) + margin
+        cell = max(float(cell), math.sqrt((x_max - x_min) * (y_max - y_min) / CoverageRaster.MAX_CELLS))
+        n_cols = max(int(math.ceil((x_max - x_min) / cell)), 1)
+        n_rows = max(int(math.ceil((y_max - y_min) / cell)), 1)
+        return CoverageRaster(x_min, y_max, cell, n_rows, n_cols)
+
+    def centres(self, rows=None, cols=None):
+        rows = np.arange(self.n_rows) if rows is None else np.asarray(rows)
+        cols = np.arange(self.n_cols) if cols is None else np.asarray(cols)
+        return self.x_min + (cols + 0.5) * self.cell, self.y_max - (rows + 0.5) * self.cell
+
+    def cells(self, x, y):
+        col = np.floor((np.asarray(x) - self.x_min) / self.cell).astype(np.int64)
+        row = np.floor((self.y_max - np.asarray(y)) / self.cell).astype(np.int64)
+        inside = (row >= 0) & (row < self.n_rows) & (col >= 0) & (col < self.n_cols)
+        return np.where(inside, row, 0), np.where(inside, col, 0), inside
+
+    def polygon_mask(self, edges):
+        # Scanline fill at cell centres with the even-odd rule, so holes stay outside. Crossings of each
+        # row become +1/-1 marks at the first cell inside and the first cell past each span; a cumulative
+        # sum along the row turns the marks into the mask
+        x1, y1, x2, y2 = edges
+        marks = np.zeros((self.n_rows, self.n_cols + 1), dtype=np.int32)
+        _, row_y = self.centres(cols=np.empty(0))
+        lo, hi = np.minimum(y1, y2), np.maximum(y1, y2)
+        chunk = max(1, CoverageRaster.CHUNK_CELLS // max(x1.size, 1))
+        for start in range(0, self.n_rows, chunk):
+            y = row_y[start:start + chunk]
+            candidates = (hi >= y.min()) & (lo <= y.max())
+            ex1, ey1, ex2, ey2 = x1[candidates], y1[candidates], x2[candidates], y2[candidates]
+            row = y[:, None]
+            straddle = (ey1 <= row) != (ey2 <= row)
+            dy = np.where(ey2 == ey1, 1.0, ey2 - ey1)
+            crossings = ex1 + (row - ey1) / dy * (ex2 - ex1)
+            crossings[~straddle] = np.nan
+            crossings.sort(axis=1)
+
+            counts = straddle.sum(axis=1)
+            flat = crossings[np.arange(crossings.shape[1]) < counts[:, None]]
+            span_row = np.repeat(np.arange(y.size), counts // 2) + start
+            first = np.clip(np.ceil((flat[0::2] - self.x_min) / self.cell - 0.5), 0, self.n_cols).astype(np.int64)
+            past = np.clip(np.ceil((flat[1::2] - self.x_min) / self.cell - 0.5), 0, self.n_cols).astype(np.int64)
+            np.add.at(marks, (span_row, first), 1)
+            np.add.at(marks, (span_row, past), -1)
+        return np.cumsum(marks, axis=1)[:, :-1] > 0
+
+    def collar_counts(self, x, y):
+        row, col, inside = self.cells(x, y)
+        flat = row[inside] * self.n_cols + col[inside]
+        return np.bincount(flat, minlength=self.n_rows * self.n_cols).reshape(self.n_rows, self.n_cols)
+
+    def nearest_distance(self, x, y):
+        # Distance from every cell centre to the nearest collar. The transform finds the nearest occupied
+        # cell, and the distance is then measured to a collar in that cell, which errs by at most one
+        # cell diagonal and only where several collars are about equally near
+        from scipy.ndimage import distance_transform_edt
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        row, col, inside = self.cells(x, y)
+        if not inside.any():
+            return np.full((self.n_rows, self.n_cols), np.inf)
+        occupant = np.full((self.n_rows, self.n_cols), -1, dtype=np.int64)
+        occupant[row[inside], col[inside]] = np.flatnonzero(inside)
+        near_row, near_col = distance_transform_edt(occupant < 0, return_distances=False, return_indices=True)
+        collar = occupant[near_row, near_col]
+        centre_x, centre_y = self.centres()
+        return np.hypot(centre_x[None, :] - x[collar], centre_y[:, None] - y[collar])
+
+    @staticmethod
+    def density(counts, cell, window):
+        # Collars per km² in a square window of about `window` metres centred on every cell
+        from scipy.ndimage import uniform_filter
+
+        size = max(int(round(window / cell)), 1)
+        area_km2 = (size * cell) ** 2 / 1e6
+        return uniform_filter(counts.astype(np.float64), size=size, mode="constant") * size * size / area_km2
+
+    @staticmethod
+    def analyse(rings, x, y, cell, gap_distance, window=1000.0):
+        edges = ProfileEngine.polygon_edges(rings)
+        raster = CoverageRaster.covering(edges, cell)
+        mask = raster.polygon_mask(edges)
+        counts = raster.collar_counts(x, y)
+        distance = raster.nearest_distance(x, y)
+        density = CoverageRaster.density(counts, raster.cell, window)
+
+        cell_area = raster.cell * raster.cell
+        area_km2 = float(mask.sum()) * cell_area / 1e6
+        inside_distance = distance[mask]
+        gap = mask & (distance > gap_distance)
+        collars_inside = int(counts.sum())
+        percentiles = np.percentile(inside_distance, [50, 90, 99]) if inside_distance.size else [0.0] * 3
+        summary = {
+            "cell": raster.cell,
+            "rows": raster.n_rows,
+            "cols": raster.n_cols,
+            "area_km2": area_km2,
+            "collars": collars_inside,
+            "holes_per_km2": collars_inside / area_km2 if area_km2 else 0.0,
+            "distance_p50": float(percentiles[0]),
+            "distance_p90": float(percentiles[1]),
+            "distance_p99": float(percentiles[2]),
+            "distance_max": float(inside_distance.max()) if inside_distance.size else 0.0,
+            "gap_distance": float(gap_distance),
+            "gap_area_km2": float(gap.sum()) * cell_area / 1e6,
+            "gap_fraction": float(gap.sum()) / max(int(mask.sum()), 1),
+        }
+        # Cells outside the polygon carry NODATA in both rasters
+        rasters = {
+            "distance": np.where(mask, distance, CoverageRaster.NODATA).astype(np.float32),
+            "density": np.where(mask, density, CoverageRaster.NODATA).astype(np.float32),
+        }
+        return raster, rasters, summary
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from depthsum_spatial import HashGrid
+
+
+KEPT, MOVED, ADDED, REMOVED = 0, 1, 2, 3
+
+
+class DesignDiff:
+    # Names of the change codes, indexed by code
+    CHANGES = ("kept", "moved", "added", "removed")
+
+    @staticmethod
+    def match(old_x, old_y, new_x, new_y, tolerance):
+        # One-to-one matching of old to new collars within tolerance, closest pairs first. Every round
+        # accepts the pairs that are the closest remaining candidate of both their collars, so the result
+        # equals a greedy matching in distance order. Returns the matched new index per old collar (-1
+        # if none) and the match distance
+        n_old = np.asarray(old_x).size
+        x = np.concatenate([np.asarray(old_x, dtype=np.float64), np.asarray(new_x, dtype=np.float64)])
+        y = np.concatenate([np.asarray(old_y, dtype=np.float64), np.asarray(new_y, dtype=np.float64)])
+        i, j = HashGrid.neighbour_pairs(x, y, tolerance)
+        cross = (i < n_old) != (j < n_old)
+        old = np.where(i < n_old, i, j)[cross]
+        new = np.where(i < n_old, j, i)[cross] - n_old
+        distance = np.hypot(x[old] - x[new + n_old], y[old] - y[new + n_old])
+
+        # Ties are broken by index so every round makes progress
+        order = np.lexsort((new, old, distance))
+        old, new, distance = old[order], new[order], distance[order]
+        matched_new = np.full(n_old, -1, dtype=np.int64)
+        match_distance = np.full(n_old, np.nan)
+        while old.size:
+            _, first_old = np.unique(old, return_index=True)
+            _, first_new = np.unique(new, return_index=True)
+            closest_for_old = np.zeros(old.size, dtype=bool)
+            closest_for_old[first_old] = True
+            closest_for_new = np.zeros(old.size, dtype=bool)
+            closest_for_new[first_new] = True
+            accepted = closest_for_old & closest_for_new
+            matched_new[old[accepted]] = new[accepted]
+            match_distance[old[accepted]] = distance[accepted]
+
+            taken_new = np.zeros(int(new.max()) + 1, dtype=bool)
+            taken_new[new[accepted]] = True
+            remaining = (matched_new[old] < 0) & ~taken_new[new]
+            old, new, distance = old[remaining], new[remaining], distance[remaining]
+        return matched_new, match_distance
+
+    @staticmethod
+    def compare(old_x, old_y, new_x, new_y, tolerance, same_distance=1e-3):
+        # Change class of every old and every new collar: matched collars closer than same_distance
+        # are kept, the others moved; unmatched new collars are added and unmatched old ones removed
+        n_new = np.asarray(new_x).size
+        matched_new, distance = DesignDiff.match(old_x, old_y, new_x, new_y, tolerance)
+        matched = matched_new >= 0
+        old_change = np.where(matched, np.where(distance <= same_distance, KEPT, MOVED), REMOVED).astype(np.int8)
+
+        new_change = np.full(n_new, ADDED, dtype=np.int8)
+        new_change[matched_new[matched]] = old_change[matched]
+        new_shift = np.zeros(n_new)
+        new_shift[matched_new[matched]] = distance[matched]
+        return old_change, new_change, new_shift
+
+    @staticmethod
+    def per_profile(old_profile, old_change, new_profile, new_change, depth=None):
+        # Collar counts and meterage change per ProfileNumber over both designs
+        old_profile = np.asarray(old_profile, dtype=np.int64)
+        new_profile = np.asarray(new_profile, dtype=np.int64)
+        size = int(max(old_profile.max(initial=0), new_profile.max(initial=0))) + 1
+        old_count = np.bincount(old_profile, minlength=size)
+        new_count = np.bincount(new_profile, minlength=size)
+        profiles = np.flatnonzero(old_count + new_count)
+        table = {
+            "profile": profiles,
+            "old_collars": old_count[profiles],
+            "new_collars": new_count[profiles],
+            "added": np.bincount(new_profile[new_change == ADDED], minlength=size)[profiles],
+            "moved": np.bincount(new_profile[new_change == MOVED], minlength=size)[profiles],
+            "removed": np.bincount(old_profile[old_change == REMOVED], minlength=size)[profiles],
+        }
+        table["meterage_change"] = (table["new_collars"] - table["old_collars"]) * (depth or 0)
+        return table
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from depthsum_grid import ProfileGrid
+from depthsum_spatial import HashGrid
+
+
+class ProfileEngine:
+    # Upper bound on profile x edge cells evaluated at once by the crossing kernel
+    CHUNK_CELLS = 4 * 1024 * 1024
+    # Distance (metres) within which a profile counts as lying on a boundary edge, Clip's default XY tolerance
+    XY_TOLERANCE = 0.001
+
+    @staticmethod
+    def collar_counts(lengths, interval):
+        # Collars sit at k * interval for k = 0, 1, ... while k * interval < length; the count is
+        # corrected in integer steps so it never depends on accumulated float error
+        lengths = np.asarray(lengths, dtype=np.float64)
+        counts = np.floor(lengths / interval)
+        counts += counts * interval < lengths
+        counts -= (counts > 0) & ((counts - 1) * interval >= lengths)
+        return np.maximum(counts, 0).astype(np.int64)
+
+    @staticmethod
+    def sample_polylines(lines, interval):
+        # lines: one list of parts per polyline, each part an (n, 2) vertex array. Parts of a line are
+        # chained with zero-length joints, matching positionAlongLine on multipart shapes
+        vertices, line_of_vertex, joint = [], [], []
+        for line_index, parts in enumerate(lines):
+            for part in parts:
+                part = np.asarray(part, dtype=np.float64)[:, :2]
+                vertices.append(part)
+                line_of_vertex.append(np.full(len(part), line_index, dtype=np.int64))
+                flags = np.zeros(len(part), dtype=bool)
+                flags[0] = True
+                joint.append(flags)
+        if not vertices:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        xy = np.concatenate(vertices)
+        line_of_vertex = np.concatenate(line_of_vertex)
+        joint = np.concatenate(joint)
+
+        # Cumulative length over all vertices; a segment ending on a part start has zero length
+        seg_len = np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1]))
+        seg_len[joint[1:]] = 0.0
+        cum = np.concatenate([[0.0], np.cumsum(seg_len)])
+
+        # Vertices are grouped by line, so each line's first and last vertex come from searchsorted
+        n_lines = len(lines)
+        line_numbers = np.arange(n_lines)
+        first = np.searchsorted(line_of_vertex, line_numbers, side="left")
+        last = np.searchsorted(line_of_vertex, line_numbers, side="right") - 1
+        present = last >= first
+        line_start = np.where(present, cum[np.minimum(first, cum.size - 1)], 0.0)
+        line_length = np.where(present, cum[np.maximum(last, 0)] - line_start, 0.0)
+
+        counts = ProfileEngine.collar_counts(line_length, interval)
+        point_line = np.repeat(line_numbers, counts)
+        point_k = np.arange(point_line.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        position = line_start[point_line] + point_k * float(interval)
+
+        # side="right" skips zero-length segments and the joints between parts and lines
+        segment = np.minimum(np.searchsorted(cum, position, side="right") - 1, seg_len.size - 1)
+        length = seg_len[segment]
+        t = (position - cum[segment]) / np.where(length > 0, length, 1.0)
+        x = xy[segment, 0] + t * (xy[segment + 1, 0] - xy[segment, 0])
+        y = xy[segment, 1] + t * (xy[segment + 1, 1] - xy[segment, 1])
+        return point_line, point_k + 1, x, y
+
+    @staticmethod
+    def polygon_edges(rings):
+        x1, y1, x2, y2 = [], [], [], []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) < 2:
+                continue
+            # Rings from geometry JSON are closed, an open ring is closed here
+            if ring[0, 0] != ring[-1, 0] or ring[0, 1] != ring[-1, 1]:
+                ring = np.vstack([ring, ring[:1]])
+            x1.append(ring[:-1, 0])
+            y1.append(ring[:-1, 1])
+            x2.append(ring[1:, 0])
+            y2.append(ring[1:, 1])
+        if not x1:
+            empty = np.empty(0)
+            return empty, empty, empty, empty
+        return np.concatenate(x1), np.concatenate(y1), np.concatenate(x2), np.concatenate(y2)
+
+    @staticmethod
+    def centroid(rings):
+        # Area centroid over all rings, as arcpy reports it for the polygon; holes run opposite to outer
+        # rings, so their signed area subtracts itself
+        x1, y1, x2, y2 = ProfileEngine.polygon_edges(rings)
+        cross = x1 * y2 - x2 * y1
+        area = cross.sum() / 2.0
+        return float(((x1 + x2) * cross).sum() / 6.0 / area), float(((y1 + y2) * cross).sum() / 6.0 / area)
+
+    @staticmethod
+    def contains(edges, x, y):
+        # Even-odd point-in-polygon test of every point against all rings, chunked like the crossing kernel
+        x1, y1, x2, y2 = edges
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        inside = np.zeros(x.size, dtype=bool)
+        chunk = max(1, ProfileEngine.CHUNK_CELLS // max(x1.size, 1))
+        dy = np.where(y2 == y1, 1.0, y2 - y1)
+        for start in range(0, x.size, chunk):
+            px, py = x[start:start + chunk, None], y[start:start + chunk, None]
+            straddle = (y1 <= py) != (y2 <= py)
+            crossing = x1 + (py - y1) / dy * (x2 - x1)
+            inside[start:start + chunk] = np.count_nonzero(straddle & (crossing > px), axis=1) % 2 == 1
+        return inside
+
+    @staticmethod
+    def to_frame(x, y, origin, azimuth):
+        # World -> frame where profiles run along +Y; inverse of the fishnet rotation in generate_profiles
+        angle = math.radians(azimuth)
+        dx = np.asarray(x, dtype=np.float64) - origin[0]
+        dy = np.asarray(y, dtype=np.float64) - origin[1]
+        return dx * math.cos(angle) - dy * math.sin(angle), dx * math.sin(angle) + dy * math.cos(angle)
+
+    @staticmethod
+    def from_frame(u, v, origin, azimuth):
+        angle = math.radians(-azimuth)
+        u = np.asarray(u, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        return (origin[0] + u * math.cos(angle) - v * math.sin(angle),
+                origin[1] + u * math.sin(angle) + v * math.cos(angle))
+
+    @staticmethod
+    def profile_offsets(extent_width, extent_height, spacing):
+        # Same frame as the fishnet: columns every `spacing` across 4 x width, lines 2 x height long
+        n_columns = int(math.ceil(4.0 * extent_width / spacing))
+        u = -2.0 * extent_width + spacing * np.arange(n_columns + 1, dtype=np.float64)
+        return u, -float(extent_height), 2.0 * float(extent_height)
+
+    @staticmethod
+    def estimate_grid(edges, origin, extent_width, spacing, azimuth, interval):
+        # Quick design estimate without clipping: profiles are the fishnet columns within the polygon's
+        # span across the azimuth, total profile length is area / spacing and a collar falls on every
+        # `interval` of it on average
+        x1, y1, x2, y2 = edges
+        fx1, fy1 = ProfileEngine.to_frame(x1, y1, origin, azimuth)
+        fx2, fy2 = ProfileEngine.to_frame(x2, y2, origin, azimuth)
+        if fx1.size == 0:
+            return {"profiles": 0, "collars": 0, "length": 0.0}
+        # Shoelace over all rings; holes run opposite to outer rings and subtract themselves
+        area = abs(float(np.sum(fx1 * fy2 - fx2 * fy1))) / 2.0
+
+        u_all, _, _ = ProfileEngine.profile_offsets(extent_width, 0.0, spacing)
+        u_min = min(float(fx1.min()), float(fx2.min())) - ProfileEngine.XY_TOLERANCE
+        u_max = max(float(fx1.max()), float(fx2.max())) + ProfileEngine.XY_TOLERANCE
+        profiles = int(np.count_nonzero((u_all >= u_min) & (u_all <= u_max)))
+        length = area / spacing
+        return {"profiles": profiles, "collars": int(round(length / interval)) if profiles else 0,
+                "length": length}
+
+    @staticmethod
+    def crossing_spans(u, edges, v0, length):
+        # Spans of every profile column inside the polygon: column index, start and end along the profile
+        x1, y1, x2, y2 = edges
+        lo = np.minimum(x1, x2)
+        hi = np.maximum(x1, x2)
+        candidates = (hi >= u.min()) & (lo <= u.max())
+        x1, y1, x2, y2 = x1[candidates], y1[candidates], x2[candidates], y2[candidates]
+
+        column = u[:, None]
+        # Half-open rule: an edge crosses the profile when exactly one end lies at or left of it. That keeps
+        # the crossing count even but drops a profile lying on a boundary edge on one side only, so edges
+        # along a profile add their own span below and the boundary counts as inside on every side
+        straddle = (x1 <= column) != (x2 <= column)
+        dx = np.where(x2 == x1, 1.0, x2 - x1)
+        crossings = y1 + (column - x1) / dx * (y2 - y1)
+        crossings[~straddle] = np.nan
+        crossings.sort(axis=1)
+
+        counts = straddle.sum(axis=1)
+        flat = crossings[np.arange(crossings.shape[1]) < counts[:, None]]
+        seg_profile = np.repeat(np.arange(u.size, dtype=np.int32), counts // 2)
+        seg_start, seg_end = flat[0::2], flat[1::2]
+
+        tolerance = ProfileEngine.XY_TOLERANCE
+        along = (np.abs(x1 - column) <= tolerance) & (np.abs(x2 - column) <= tolerance)
+        if along.any():
+            along_profile, along_edge = np.nonzero(along)
+            spans = ProfileEngine.union_spans(
+                (np.concatenate([seg_profile, along_profile.astype(np.int32)]),
+                 np.concatenate([seg_start, np.minimum(y1, y2)[along_edge]]),
+                 np.concatenate([seg_end, np.maximum(y1, y2)[along_edge]])))
+            seg_profile, seg_start, seg_end = spans
+
+        seg_start = np.maximum(seg_start, v0)
+        seg_end = np.minimum(seg_end, v0 + length)
+        keep = seg_end > seg_start
+        return seg_profile[keep], seg_start[keep], seg_end[keep]
+
+    @staticmethod
+    def union_spans(spans):
+        # Overlapping or touching spans of a profile merged into one; a sweep over the sorted ends with a
+        # running count, as in intersect_spans
+        profile, start, end = spans
+        position = np.concatenate([start, end])
+        column = np.concatenate([profile, profile])
+        delta = np.concatenate([np.ones(start.size), -np.ones(start.size)]).astype(np.int64)
+        # Starts sort before ends at the same position, so touching spans join
+        order = np.lexsort((-delta, position, column))
+        position, column, delta = position[order], column[order], delta[order]
+        count = np.cumsum(delta)
+        opens = np.flatnonzero((delta > 0) & (count == 1))
+        closes = np.flatnonzero((delta < 0) & (count == 0))
+        return column[opens], position[opens], position[closes]
+
+    @staticmethod
+    def intersect_spans(spans, mask_spans):
+        # Parts of spans that also lie in mask_spans. Both sets are disjoint per profile, so a sweep over
+        # their sorted ends with one running count per set finds where both counts are 1
+        (profile, start, end), (m_profile, m_start, m_end) = spans, mask_spans
+        position = np.concatenate([start, end, m_start, m_end])
+        column = np.concatenate([profile, profile, m_profile, m_profile])
+        n, m = start.size, m_start.size
+        delta = np.concatenate([np.ones(n), -np.ones(n), np.zeros(2 * m)]).astype(np.int64)
+        m_delta = np.concatenate([np.zeros(2 * n), np.ones(m), -np.ones(m)]).astype(np.int64)
+        # Ends sort before starts at the same position, so touching spans do not overlap
+        order = np.lexsort((delta + m_delta, position, column))
+        position, column = position[order], column[order]
+        inside = (np.cumsum(delta[order]) > 0) & (np.cumsum(m_delta[order]) > 0)
+        k = np.flatnonzero(inside[:-1] & (position[1:] > position[:-1]))
+        return column[k], position[k], position[k + 1]
+
+    @staticmethod
+    def clip_chunk(u, edges, v0, length, interval, mask_edges=None):
+        # mask_edges: a second polygon the spans are also clipped by, e.g. the block around an infill zone
+        seg_profile, seg_start, seg_end = ProfileEngine.crossing_spans(u, edges, v0, length)
+        if mask_edges is not None:
+            seg_profile, seg_start, seg_end = ProfileEngine.intersect_spans(
+                (seg_profile, seg_start, seg_end), ProfileEngine.crossing_spans(u, mask_edges, v0, length))
+
+        # Collars sit at v0 + k * interval on the unclipped profile, as in generate_points; one within
+        # XY_TOLERANCE of a span end is on the boundary and kept, whatever rounding the rotation left
+        k_max = int(ProfileEngine.collar_counts(length, interval)) - 1
+        tolerance = ProfileEngine.XY_TOLERANCE
+        k_first = np.maximum(np.ceil((seg_start - v0 - tolerance) / interval), 0).astype(np.int64)
+        k_last = np.minimum(np.floor((seg_end - v0 + tolerance) / interval), k_max).astype(np.int64)
+        n_collars = np.maximum(k_last - k_first + 1, 0)
+        seg_offsets = np.cumsum(n_collars) - n_collars
+        col_segment = np.repeat(np.arange(n_collars.size), n_collars)
+        col_k = k_first[col_segment] + (np.arange(col_segment.size) - seg_offsets[col_segment])
+
+        return {
+            "seg_profile": seg_profile,
+            "seg_start": seg_start,
+            "seg_end": seg_end,
+            "col_profile": seg_profile[col_segment],
+            "col_k": col_k,
+        }
+
+    @staticmethod
+    def frame_edges(rings, origin, azimuth):
+        x1, y1, x2, y2 = ProfileEngine.polygon_edges(rings)
+        fx1, fy1 = ProfileEngine.to_frame(x1, y1, origin, azimuth)
+        fx2, fy2 = ProfileEngine.to_frame(x2, y2, origin, azimuth)
+        return fx1, fy1, fx2, fy2
+
+    @staticmethod
+    def clip_profiles(rings, origin, extent_width, extent_height, spacing, azimuth, interval, workers=None,
+                      mask_rings=None):
+        # mask_rings: optional second polygon; profiles keep only the parts inside both
+        u_all, v0, length = ProfileEngine.profile_offsets(extent_width, extent_height, spacing)
+        edges = ProfileEngine.frame_edges(rings, origin, azimuth)
+        mask_edges = ProfileEngine.frame_edges(mask_rings, origin, azimuth) if mask_rings is not None else None
+        n_edges = edges[0].size + (mask_edges[0].size if mask_edges is not None else 0)
+
+        workers = max(1, int(workers or os.cpu_count() or 1))
+        chunk = max(1, min(ProfileEngine.CHUNK_CELLS // max(n_edges, 1),
+                           int(math.ceil(u_all.size / (4.0 * workers)))))
+        starts = list(range(0, u_all.size, chunk))
+
+        def run(start):
+            part = ProfileEngine.clip_chunk(u_all[start:start + chunk], edges, v0, length, interval, mask_edges)
+            part["seg_profile"] = part["seg_profile"] + start
+            part["col_profile"] = part["col_profile"] + start
+            return part
+
+        if workers == 1 or len(starts) == 1:
+            parts = [run(start) for start in starts]
+        else:
+            # NumPy releases the GIL inside the kernel; map() keeps chunk order so output matches a serial run
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(run, starts))
+
+        result = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+        # Profiles left with at least one segment are numbered 1..n in frame order
+        kept = np.unique(result["seg_profile"])
+        profile_ids = np.zeros(u_all.size, dtype=np.int32)
+        profile_ids[kept] = np.arange(1, kept.size + 1, dtype=np.int32)
+
+        # Coordinates stay relative to the origin, rotated back to world axes
+        seg_u = u_all[result["seg_profile"]]
+        col_u = u_all[result["col_profile"]]
+        col_v = v0 + result["col_k"] * float(interval)
+        seg_x1, seg_y1 = ProfileEngine.from_frame(seg_u, result["seg_start"], (0.0, 0.0), azimuth)
+        seg_x2, seg_y2 = ProfileEngine.from_frame(seg_u, result["seg_end"], (0.0, 0.0), azimuth)
+        col_x, col_y = ProfileEngine.from_frame(col_u, col_v, (0.0, 0.0), azimuth)
+
+        return ProfileGrid(
+            origin,
+            profile_ids=profile_ids[kept],
+            profile_lengths=np.bincount(profile_ids[result["seg_profile"]],
+                                        weights=result["seg_end"] - result["seg_start"],
+                                        minlength=kept.size + 1)[1:],
+            seg_ids=profile_ids[result["seg_profile"]],
+            seg_x1=seg_x1, seg_y1=seg_y1, seg_x2=seg_x2, seg_y2=seg_y2,
+            col_ids=profile_ids[result["col_profile"]],
+            col_x=col_x, col_y=col_y,
+        )
+
+    @staticmethod
+    def clip_zones(zones, origin, extent_width, extent_height, azimuth, tolerance=None, workers=None):
+        # zones: dicts with rings, spacing, interval and priority, the base polygon first; every lattice
+        # shares the frame of the base polygon, so fine lattices whose steps divide the coarse ones coincide
+        # with it. Infill zones are clipped by the base polygon too, so nothing is placed outside the block.
+        # Returns the combined grid and the number of coinciding collars removed
+        grids = [ProfileEngine.clip_profiles(zone["rings"], origin, extent_width, extent_height,
+                                             zone["spacing"], azimuth, zone["interval"], workers,
+                                             mask_rings=zones[0]["rings"] if index else None)
+                 for index, zone in enumerate(zones)]
+        if tolerance is None:
+            tolerance = 1e-3 * min(zone["interval"] for zone in zones)
+
+        # Profiles are numbered consecutively zone after zone
+        grid = ProfileGrid.concatenate(grids)
+        priority = np.array([zone.get("priority", index) for index, zone in enumerate(zones)],
+                            dtype=np.float64)
+        keep, _ = HashGrid.dedupe(grid.col_x, grid.col_y, tolerance, priority[grid.col_zone])
+        grid = grid.replace_collars(keep)
+        grid.col_numbers = np.arange(1, grid.n_collars + 1, dtype=np.int32)
+        return grid, int((~keep).sum())
+
+    @staticmethod
+    def clip_domains(domains, interval, tolerance=None, workers=None):
+        # domains: dicts with rings, origin, extent_width, extent_height, spacing and azimuth. Each
+        # domain keeps its own lattice anchored on its own origin; domains run in parallel and are
+        # then stitched on the first domain's origin with profiles numbered domain after domain.
+        # Returns the combined grid and the number of seam collars removed
+        if not domains:
+            return ProfileGrid(), 0
+
+        def run(domain):
+            return ProfileEngine.clip_profiles(domain["rings"], domain["origin"], domain["extent_width"],
+                                               domain["extent_height"], domain["spacing"], domain["azimuth"],
+                                               interval, workers=1)
+
+        workers = max(1, min(int(workers or os.cpu_count() or 1), len(domains)))
+        if workers == 1:
+            grids = [run(domain) for domain in domains]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                grids = list(pool.map(run, domains))
+        origin = domains[0]["origin"]
+        grid = ProfileGrid.concatenate([part.rebase(origin) for part in grids])
+
+        # Collars of neighbouring domains closer than tolerance across a seam: the later domain yields
+        if tolerance is None:
+            tolerance = 0.5 * interval
+        i, j = HashGrid.neighbour_pairs(grid.col_x, grid.col_y, tolerance)
+        seam = grid.col_zone[i] != grid.col_zone[j]
+        i, j = i[seam], j[seam]
+        keep = np.ones(grid.n_collars, dtype=bool)
+        keep[np.where(grid.col_zone[i] > grid.col_zone[j], i, j)] = False
+        grid = grid.replace_collars(keep)
+        grid.col_numbers = np.arange(1, grid.n_collars + 1, dtype=np.int32)
+        return grid, int((~keep).sum())
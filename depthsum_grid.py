@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class ProfileGrid:
+    # Columnar state of a design passed between stages: one contiguous array per column, coordinates
+    # as float64 offsets from a local origin and int32 IDs, so a collar costs 36 bytes. Profiles are
+    # numbered 1..n in profile_ids order
+    PROFILE_COLUMNS = {"profile_ids": np.int32, "profile_zone": np.int32, "profile_lengths": np.float64}
+    SEGMENT_COLUMNS = {"seg_ids": np.int32, "seg_x1": np.float64, "seg_y1": np.float64,
+                       "seg_x2": np.float64, "seg_y2": np.float64}
+    COLLAR_COLUMNS = {"col_ids": np.int32, "col_numbers": np.int32, "col_zone": np.int32,
+                      "col_x": np.float64, "col_y": np.float64, "col_shift": np.float64}
+
+    def __init__(self, origin=(0.0, 0.0), col_merged=None, **columns):
+        self.origin = (float(origin[0]), float(origin[1]))
+        for group, key in ((ProfileGrid.PROFILE_COLUMNS, "profile_ids"), (ProfileGrid.SEGMENT_COLUMNS, "seg_ids"),
+                           (ProfileGrid.COLLAR_COLUMNS, "col_ids")):
+            size = len(columns.get(key, ()))
+            for name, dtype in group.items():
+                values = columns.get(name)
+                if values is None:
+                    values = np.arange(1, size + 1) if name == "col_numbers" else np.zeros(size)
+                setattr(self, name, np.ascontiguousarray(values, dtype=dtype))
+        # Provenance text of merged collars; None until a merge has run
+        self.col_merged = col_merged
+
+    @property
+    def n_profiles(self):
+        return self.profile_ids.size
+
+    @property
+    def n_collars(self):
+        return self.col_ids.size
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for group in (ProfileGrid.PROFILE_COLUMNS, ProfileGrid.SEGMENT_COLUMNS,
+                                                             ProfileGrid.COLLAR_COLUMNS) for name in group)
+
+    def columns(self, group):
+        return {name: getattr(self, name) for name in group}
+
+    def collar_counts(self):
+        return np.bincount(self.col_ids, minlength=self.n_profiles + 1)[1:self.n_profiles + 1]
+
+    def collar_world(self):
+        return self.col_x + self.origin[0], self.col_y + self.origin[1]
+
+    def segment_world(self):
+        return (self.seg_x1 + self.origin[0], self.seg_y1 + self.origin[1],
+                self.seg_x2 + self.origin[0], self.seg_y2 + self.origin[1])
+
+    def to_local(self, x, y):
+        return np.asarray(x, dtype=np.float64) - self.origin[0], np.asarray(y, dtype=np.float64) - self.origin[1]
+
+    def rebase(self, origin):
+        # Same grid with coordinates relative to another origin
+        dx, dy = self.origin[0] - float(origin[0]), self.origin[1] - float(origin[1])
+        columns = {**self.columns(ProfileGrid.PROFILE_COLUMNS), **self.columns(ProfileGrid.SEGMENT_COLUMNS),
+                   **self.columns(ProfileGrid.COLLAR_COLUMNS)}
+        for name in ("seg_x1", "seg_x2", "col_x"):
+            columns[name] = columns[name] + dx
+        for name in ("seg_y1", "seg_y2", "col_y"):
+            columns[name] = columns[name] + dy
+        return ProfileGrid(origin, self.col_merged, **columns)
+
+    def replace_collars(self, index=None, **columns):
+        # New grid sharing the profile and segment arrays; collar columns are taken at `index` (a mask
+        # or positions) and then overridden by `columns`
+        collars = self.columns(ProfileGrid.COLLAR_COLUMNS)
+        merged = self.col_merged
+        if index is not None:
+            collars = {name: values[index] for name, values in collars.items()}
+            merged = None if merged is None else merged[index]
+        merged = columns.pop("col_merged", merged)
+        collars.update(columns)
+        return ProfileGrid(self.origin, merged, **self.columns(ProfileGrid.PROFILE_COLUMNS),
+                           **self.columns(ProfileGrid.SEGMENT_COLUMNS), **collars)
+
+    @staticmethod
+    def concatenate(grids):
+        # Profiles are renumbered consecutively grid after grid and each grid becomes its own zone
+        if not grids:
+            return ProfileGrid()
+        origin = grids[0].origin
+        if any(grid.origin != origin for grid in grids):
+            raise ValueError("Profile grids with different origins cannot be combined")
+        offsets = np.cumsum([0] + [grid.n_profiles for grid in grids])
+        columns = {}
+        for group in (ProfileGrid.PROFILE_COLUMNS, ProfileGrid.SEGMENT_COLUMNS, ProfileGrid.COLLAR_COLUMNS):
+            for name in group:
+                columns[name] = np.concatenate([getattr(grid, name) for grid in grids])
+        for name, key in (("profile_ids", "profile_zone"), ("seg_ids", None), ("col_ids", "col_zone")):
+            sizes = [getattr(grid, name).size for grid in grids]
+            columns[name] = columns[name] + np.repeat(offsets[:-1], sizes).astype(np.int32)
+            if key:
+                columns[key] = np.repeat(np.arange(len(grids), dtype=np.int32), sizes)
+        columns["col_numbers"] = np.arange(1, columns["col_ids"].size + 1)
+        return ProfileGrid(origin, **columns)
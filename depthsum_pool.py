@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(workers, initializer=None, initargs=()):
+    # Inside ArcGIS Pro sys.executable is ArcGISPro.exe, child processes need the env interpreter.
+    # initializer runs once in every worker, e.g. to hand it arrays that tasks then refer to
+    python_exe = os.path.join(sys.exec_prefix, "python.exe")
+    if os.path.exists(python_exe):
+        multiprocessing.set_executable(python_exe)
+    return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import importlib.util
+import json
+import math
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from importlib.machinery import SourceFileLoader
+
+import numpy as np
+
+from depthsum_diff import DesignDiff
+from depthsum_engine import ProfileEngine
+
+
+TOOLBOX_FOLDER = os.path.dirname(os.path.abspath(__file__))
+GOLDEN = os.path.join(TOOLBOX_FOLDER, "depthsum_golden.json")
+
+# Synthetic blocks in WGS 84 / UTM zone 35N, so no generation reprojects them. Integer parameters,
+# as the older toolboxes take Long values; every centroid lies inside its polygon, so arcpy's
+# centroid and the area centroid used here agree
+SPATIAL_REFERENCE = 32635
+X0, Y0 = 500000.0, 6000000.0
+# Closest a profile may run to an edge, or a collar sit to the boundary, in a regression case (metres)
+BOUNDARY_CLEARANCE = 0.01
+
+
+def rectangle(x_min, y_min, x_max, y_max, clockwise=True):
+    ring = [[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min], [x_min, y_min]]
+    return ring if clockwise else ring[::-1]
+
+
+def ellipse(cx, cy, a, b, rotation, n=720):
+    angles = np.linspace(0.0, -2.0 * np.pi, n + 1)
+    x, y = a * np.cos(angles), b * np.sin(angles)
+    cos, sin = math.cos(math.radians(rotation)), math.sin(math.radians(rotation))
+    ring = np.column_stack([cx + x * cos - y * sin, cy + x * sin + y * cos])
+    ring[-1] = ring[0]
+    return ring.tolist()
+
+
+# No case puts a profile along an edge or a collar on the boundary, where engines may differ within
+# their XY tolerance; run_reference refuses such cases. The rectangle also carries counts worked out
+# by hand: 3050 x 2010 m puts profiles 1500 m either side of the centroid every 100 m (31) and collars
+# 985 m below to 990 m above it every 25 m, counted from 2010 m below (80 per profile)
+CASES = [
+    {"name": "rectangle", "rings": [rectangle(X0, Y0, X0 + 3050, Y0 + 2010)],
+     "spacing": 100, "azimuth": 0, "interval": 25, "depth": 50,
+     "expected": {"profiles": 31, "collars": 31 * 80}},
+    {"name": "rotated_ellipse", "rings": [ellipse(X0, Y0, 2500, 1500, 20)],
+     "spacing": 150, "azimuth": 30, "interval": 40, "depth": 80},
+    {"name": "l_shape_with_hole",
+     "rings": [[[X0, Y0], [X0, Y0 + 3000], [X0 + 1500, Y0 + 3000], [X0 + 1500, Y0 + 1500], [X0 + 3000, Y0 + 1500],
+                [X0 + 3000, Y0], [X0, Y0]],
+               rectangle(X0 + 300, Y0 + 2000, X0 + 700, Y0 + 2400, clockwise=False)],
+     "spacing": 100, "azimuth": 135, "interval": 20, "depth": 30},
+    {"name": "multipart", "rings": [rectangle(X0, Y0, X0 + 3000, Y0 + 3000), rectangle(X0 + 4000, Y0, X0 + 4500, Y0 + 500)],
+     "spacing": 120, "azimuth": 60, "interval": 30, "depth": 60},
+]
+
+# Toolbox generations run through arcpy; outputs are found where each generation writes them
+GENERATIONS = {
+    "DepthSum": "DepthSum.py",
+    "depthsum2": "depthsum2.py",
+    "depthsum3": "depthsum3.py",
+    "depthsum4": "depthsum4.py",
+    "depthsum4-inprocess": "depthsum4.py",
+}
+
+
+def run_engine(case):
+    # The in-process engine as depthsum4 runs it: lattice anchored on the polygon centroid, fishnet
+    # sized from the extent, meterage from the collars placed
+    xy = np.concatenate([np.asarray(ring, dtype=np.float64) for ring in case["rings"]])
+    width, height = xy.max(axis=0) - xy.min(axis=0)
+    origin = ProfileEngine.centroid(case["rings"])
+    grid = ProfileEngine.clip_profiles(case["rings"], origin, width, height, case["spacing"], case["azimuth"],
+                                       case["interval"], workers=1)
+    x, y = grid.collar_world()
+    return {"profiles": int(grid.n_profiles), "collars": int(grid.n_collars),
+            "total_meterage": float(grid.n_collars * case["depth"]), "x": x, "y": y}
+
+
+def run_reference(case):
+    # Independent reference the golden file is recorded from: the fishnet, Clip and points-along-line
+    # pipeline worked one profile at a time in plain Python, sharing no code with ProfileEngine.
+    # Profiles run along +v through the area centroid, 4 x width across and 2 x height long; a profile
+    # keeps the spans between its boundary crossings and a collar every interval from its start
+    rings = [[(float(x), float(y)) for x, y in ring] for ring in case["rings"]]
+    area = cx = cy = 0.0
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            cross = x1 * y2 - x2 * y1
+            area += cross / 2.0
+            cx += (x1 + x2) * cross / 6.0
+            cy += (y1 + y2) * cross / 6.0
+    cx, cy = cx / area, cy / area
+    xs = [x for ring in rings for x, _ in ring]
+    ys = [y for ring in rings for _, y in ring]
+    width, height = max(xs) - min(xs), max(ys) - min(ys)
+
+    cos, sin = math.cos(math.radians(case["azimuth"])), math.sin(math.radians(case["azimuth"]))
+    edges = []
+    for ring in rings:
+        frame = [((x - cx) * cos - (y - cy) * sin, (x - cx) * sin + (y - cy) * cos) for x, y in ring]
+        edges.extend(zip(frame[:-1], frame[1:]))
+
+    spacing, interval = case["spacing"], case["interval"]
+    start, length = -height, 2.0 * height
+    n_points = int(math.ceil(length / interval))
+    profiles, x, y = 0, [], []
+    for column in range(int(math.ceil(4.0 * width / spacing)) + 1):
+        u = -2.0 * width + spacing * column
+        if any(abs(u1 - u) <= BOUNDARY_CLEARANCE and abs(u2 - u) <= BOUNDARY_CLEARANCE
+               for (u1, _), (u2, _) in edges):
+            raise ValueError(f"{case['name']}: a profile runs along a polygon edge")
+        crossings = sorted(v1 + (u - u1) / (u2 - u1) * (v2 - v1) for (u1, v1), (u2, v2) in edges
+                           if (u1 <= u) != (u2 <= u))
+        spans = [(max(a, start), min(b, start + length)) for a, b in zip(crossings[0::2], crossings[1::2])]
+        spans = [(a, b) for a, b in spans if b > a]
+        if not spans:
+            continue
+        profiles += 1
+        for k in range(n_points):
+            v = start + k * interval
+            if any(abs(v - end) <= BOUNDARY_CLEARANCE for span in spans for end in span):
+                raise ValueError(f"{case['name']}: a collar falls on the polygon boundary")
+            if any(a <= v <= b for a, b in spans):
+                x.append(cx + u * cos + v * sin)
+                y.append(cy - u * sin + v * cos)
+    return {"profiles": profiles, "collars": len(x), "total_meterage": float(len(x) * case["depth"]),
+            "x": np.array(x), "y": np.array(y)}
+
+
+def load_toolbox(path):
+    loader = SourceFileLoader("depthsum_regression_" + os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+    return module
+
+
+def run_generation(name, case, work_folder):
+    import arcpy
+
+    path = os.path.join(TOOLBOX_FOLDER, GENERATIONS[name])
+    arcpy.env.overwriteOutput = True
+    arcpy.env.scratchWorkspace = work_folder
+    polygon_fc = os.path.join(arcpy.env.scratchGDB, f"case_{case['name']}")
+    if not arcpy.Exists(polygon_fc):
+        spatial_ref = arcpy.SpatialReference(SPATIAL_REFERENCE)
+        arcpy.CreateFeatureclass_management(os.path.dirname(polygon_fc), os.path.basename(polygon_fc), "POLYGON",
+                                            spatial_reference=spatial_ref)
+        shape = arcpy.AsShape({"rings": case["rings"], "spatialReference": {"wkid": SPATIAL_REFERENCE}}, True)
+        with arcpy.da.InsertCursor(polygon_fc, ["SHAPE@"]) as cursor:
+            cursor.insertRow([shape])
+
+    tool = load_toolbox(path).Toolbox().tools[0]()
+    parameters = tool.getParameterInfo()
+    # The first six parameters keep their order in every generation
+    for index, value in enumerate([polygon_fc, case["spacing"], case["azimuth"], case["interval"], case["depth"],
+                                   False]):
+        parameters[index].value = value
+    if name == "depthsum4-inprocess":
+        {parameter.name: parameter for parameter in parameters}["clip_engine"].value = "In-process"
+    started_runs = set(glob.glob(os.path.join(TOOLBOX_FOLDER, "results", "run_*.gdb")))
+    tool.execute(parameters, None)
+
+    if name.startswith("depthsum4"):
+        runs = sorted(set(glob.glob(os.path.join(TOOLBOX_FOLDER, "results", "run_*.gdb"))) - started_runs)
+        if not runs:
+            raise RuntimeError("depthsum4 wrote no result geodatabase")
+        profiles, collars = os.path.join(runs[-1], "profiles"), os.path.join(runs[-1], "collars")
+    elif name == "DepthSum":
+        profiles = os.path.join(arcpy.env.scratchGDB, "generated_profiles")
+        collars = os.path.join(arcpy.env.scratchGDB, "generated_points")
+    else:
+        # depthsum2 and depthsum3 pin their scratch geodatabase beside the toolbox
+        scratch = os.path.join(TOOLBOX_FOLDER, "scratch.gdb")
+        profiles = os.path.join(scratch, "profiles" if name == "depthsum3" else "generated_profiles")
+        collars = os.path.join(scratch, "collars" if name == "depthsum3" else "generated_points")
+
+    fields = [field.name for field in arcpy.ListFields(profiles)]
+    lines = arcpy.da.FeatureClassToNumPyArray(profiles, ["OID@"] + (["TotalMeterage"] if "TotalMeterage" in fields
+                                                                    else []), null_value=0)
+    result = {"profiles": int(lines.size), "collars": None, "x": None, "y": None}
+    if collars and arcpy.Exists(collars):
+        points = arcpy.da.FeatureClassToNumPyArray(collars, ["SHAPE@XY"])["SHAPE@XY"]
+        result.update(collars=int(len(points)), x=points[:, 0], y=points[:, 1])
+    if "TotalMeterage" in fields:
+        result["total_meterage"] = float(lines["TotalMeterage"].sum())
+    else:
+        result["total_meterage"] = float((result["collars"] or 0) * case["depth"])
+    return result
+
+
+def run(name, case, repeat, work_folder):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        if name == "engine":
+            result = run_engine(case)
+        elif name == "reference":
+            result = run_reference(case)
+        else:
+            result = run_generation(name, case, work_folder)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    result["time_ms"] = statistics.median(timings)
+    return result
+
+
+def record(case, result):
+    # Collar coordinates are kept to the centimetre relative to the block corner
+    return {
+        "profiles": result["profiles"],
+        "collars": result["collars"],
+        "total_meterage": result["total_meterage"],
+        "x_cm": np.round((result["x"] - X0) * 100).astype(np.int64).tolist(),
+        "y_cm": np.round((result["y"] - Y0) * 100).astype(np.int64).tolist(),
+    }
+
+
+def compare(golden, result, args, baseline_ms=None):
+    # Returns a list of (check, ok, detail); baseline_ms is the reference engine timed in this run
+    checks = [("profiles", abs(result["profiles"] - golden["profiles"]) <= args.profile_tolerance,
+               f"{result['profiles']} vs {golden['profiles']}")]
+    meterage_error = abs(result["total_meterage"] - golden["total_meterage"]) / max(golden["total_meterage"], 1.0)
+    checks.append(("total_meterage", meterage_error <= args.meterage_tolerance,
+                   f"{result['total_meterage']:.0f} vs {golden['total_meterage']:.0f} ({meterage_error:.2%})"))
+    if result["collars"] is None:
+        checks.append(("collars", True, "not produced by this generation"))
+    else:
+        golden_x = X0 + np.asarray(golden["x_cm"], dtype=np.float64) / 100.0
+        golden_y = Y0 + np.asarray(golden["y_cm"], dtype=np.float64) / 100.0
+        matched, _ = DesignDiff.match(golden_x, golden_y, result["x"], result["y"], args.coordinate_tolerance)
+        n_matched = int((matched >= 0).sum())
+        unmatched = (golden["collars"] - n_matched) + (result["collars"] - n_matched)
+        checks.append(("collars", unmatched <= args.collar_tolerance * max(golden["collars"], 1),
+                       f"{result['collars']} vs {golden['collars']}, {n_matched} within "
+                       f"{args.coordinate_tolerance} m, {unmatched} unmatched"))
+    if baseline_ms is None:
+        checks.append(("time", True, f"{result['time_ms']:.1f} ms"))
+    else:
+        ratio = result["time_ms"] / max(baseline_ms, 1e-6)
+        checks.append(("time", args.max_slowdown is None or ratio <= args.max_slowdown,
+                       f"{result['time_ms']:.1f} ms, {ratio:.3f} x {args.reference} ({baseline_ms:.1f} ms)"))
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden-output regression and timing across DepthSum engines")
+    engines = ["engine", "reference"] + list(GENERATIONS)
+    parser.add_argument("--engines", nargs="+", default=["engine"], choices=engines,
+                        help="engines to check; the toolbox generations need arcpy")
+    parser.add_argument("--reference", default="reference", choices=engines,
+                        help="engine the golden file is recorded from and timings are measured against")
+    parser.add_argument("--cases", nargs="+", default=None, help="case names (default all)")
+    parser.add_argument("--record", action="store_true",
+                        help="write the golden file from the reference engine instead of checking")
+    parser.add_argument("--golden", default=GOLDEN)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--profile-tolerance", type=int, default=0)
+    parser.add_argument("--meterage-tolerance", type=float, default=0.001, help="relative")
+    parser.add_argument("--collar-tolerance", type=float, default=0.001,
+                        help="unmatched collars as a fraction of the golden count")
+    parser.add_argument("--coordinate-tolerance", type=float, default=0.05, help="meters")
+    parser.add_argument("--max-slowdown", type=float, default=None,
+                        help="fail when an engine takes more than this multiple of the reference engine's time, "
+                             "both measured in this run (below 1 demands a speed-up)")
+    args = parser.parse_args()
+
+    cases = [case for case in CASES if args.cases is None or case["name"] in args.cases]
+    work_folder = tempfile.mkdtemp(prefix="depthsum_regression_")
+    try:
+        if args.record:
+            golden = {"reference": args.reference, "spatial_reference": SPATIAL_REFERENCE, "origin": [X0, Y0],
+                      "cases": {}}
+            for case in cases:
+                result = run(args.reference, case, args.repeat, work_folder)
+                expected = case.get("expected", {})
+                if any(result[key] != value for key, value in expected.items()):
+                    print(f"{case['name']}: {args.reference} gives {result['profiles']} profiles and "
+                          f"{result['collars']} collars, expected {expected}; golden file not written")
+                    return 1
+                golden["cases"][case["name"]] = {
+                    "parameters": {key: case[key] for key in ("spacing", "azimuth", "interval", "depth")},
+                    **record(case, result)}
+                print(f"{case['name']}: {result['profiles']} profiles, {result['collars']} collars, "
+                      f"{result['total_meterage']:.0f} m, {result['time_ms']:.1f} ms")
+            with open(args.golden, "w", encoding="utf-8") as file:
+                json.dump(golden, file, separators=(",", ":"))
+            print(f"Golden outputs written: {args.golden}")
+            return 0
+
+        with open(args.golden, encoding="utf-8") as file:
+            golden = json.load(file)
+        failed = False
+        # Timings are only comparable on one machine, so the reference engine is timed here alongside
+        baselines = {}
+        if args.max_slowdown:
+            for case in cases:
+                baselines[case["name"]] = run(args.reference, case, args.repeat, work_folder)["time_ms"]
+        for engine in args.engines:
+            for case in cases:
+                expected = golden["cases"][case["name"]]
+                try:
+                    checks = compare(expected, run(engine, case, args.repeat, work_folder), args,
+                                     baselines.get(case["name"]))
+                except ImportError as e:
+                    print(f"{engine} / {case['name']}: SKIPPED ({e})")
+                    continue
+                ok = all(passed for _, passed, _ in checks)
+                failed = failed or not ok
+                print(f"{engine} / {case['name']}: {'PASS' if ok else 'FAIL'}")
+                for check, passed, detail in checks:
+                    print(f"  {check}: {'ok' if passed else 'FAIL'} {detail}")
+        print("FAIL" if failed else "PASS")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+
+INDEX_NAME = "depth_log_index.jsonl"
+
+
+class RunLog:
+    def __init__(self, log_folder):
+        self.log_folder = log_folder
+        self.started = datetime.datetime.now()
+        self.run_id = self.started.strftime("%Y%m%d_%H%M%S_%f")
+        self.params = {}
+        self.polygon_hash = None
+        self.timings = {}
+        self.summary = {}
+        self.profiles = None
+        self.diff = None
+        self._last_mark = time.perf_counter()
+
+    def mark(self, stage):
+        # Time spent since the previous mark is booked to `stage`
+        now = time.perf_counter()
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + now - self._last_mark, 4)
+        self._last_mark = now
+
+    def set_profiles(self, ids, lengths, collars, meterage=None):
+        self.profiles = {
+            "id": np.asarray(ids).tolist(),
+            "length": np.round(np.asarray(lengths, dtype=np.float64), 2).tolist(),
+            "collars": np.asarray(collars).tolist(),
+            "meterage": None if meterage is None else np.asarray(meterage).tolist(),
+        }
+
+    def set_diff(self, table):
+        # Per-profile design changes go to the run's own log as "diff" records; the summary that the
+        # index and the catalog copy keeps only the totals
+        self.diff = {key: np.asarray(values).tolist() for key, values in table.items()}
+
+    def header(self):
+        return {
+            "type": "run",
+            "run_id": self.run_id,
+            "timestamp": self.started.isoformat(timespec="seconds"),
+            "params": self.params,
+            "polygon_hash": self.polygon_hash,
+            "timings": self.timings,
+            "summary": self.summary,
+        }
+
+    def flush(self):
+        if not os.path.exists(self.log_folder):
+            os.makedirs(self.log_folder)
+
+        # Whole log is built in memory and written with a single call
+        lines = [json.dumps(self.header(), default=str)]
+        if self.profiles:
+            meterage = self.profiles["meterage"] or [None] * len(self.profiles["id"])
+            lines.extend(json.dumps({"type": "profile", "id": pid, "length": length, "collars": collars,
+                                     "meterage": depth})
+                         for pid, length, collars, depth in zip(self.profiles["id"], self.profiles["length"],
+                                                                self.profiles["collars"], meterage))
+        if self.diff:
+            keys = list(self.diff)
+            lines.extend(json.dumps({"type": "diff", **dict(zip(keys, row))}) for row in zip(*self.diff.values()))
+        log_file = os.path.join(self.log_folder, f"depth_log_{self.run_id}.jsonl")
+        with open(log_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+        entry = {
+            "run_id": self.run_id,
+            "timestamp": self.started.isoformat(timespec="seconds"),
+            "file": os.path.basename(log_file),
+            "polygon_hash": self.polygon_hash,
+            "params": self.params,
+            "summary": self.summary,
+        }
+        with open(os.path.join(self.log_folder, INDEX_NAME), "a", encoding="utf-8") as index:
+            index.write(json.dumps(entry, default=str) + "\n")
+        return log_file
+
+    @staticmethod
+    def read_index(log_folder, polygon_hash=None, since=None):
+        index_path = os.path.join(log_folder, INDEX_NAME)
+        if not os.path.exists(index_path):
+            return []
+        entries = []
+        with open(index_path, "r", encoding="utf-8") as index:
+            for line in index:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if polygon_hash and entry.get("polygon_hash") != polygon_hash:
+                    continue
+                if since and entry.get("timestamp", "") < since:
+                    continue
+                entries.append(entry)
+        return entries
+
+    @staticmethod
+    def read_log(log_file):
+        # Returns the run header, the profile records and the design-diff records
+        header, profiles, diff = None, [], []
+        with open(log_file, "r", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                if record.get("type") == "run":
+                    header = record
+                elif record.get("type") == "diff":
+                    diff.append(record)
+                else:
+                    profiles.append(record)
+        return header, profiles, diff
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class SamplePlan:
+    # Kind codes of the sample sequence; QA/QC samples follow the routine sample that triggers them
+    KINDS = ("sample", "duplicate", "standard", "blank")
+
+    @staticmethod
+    def sequence(n_samples, duplicate_every=0, standard_every=0, blank_every=0):
+        # Dispatch order of routine samples with QA/QC inserted after every N-th routine sample.
+        # Returns the routine sample index behind every row (the parent for duplicates, -1 for
+        # standards and blanks) and the kind code of every row
+        k = np.arange(1, n_samples + 1)
+        flags = np.ones((n_samples, len(SamplePlan.KINDS)), dtype=bool)
+        for column, every in enumerate((duplicate_every, standard_every, blank_every), start=1):
+            flags[:, column] = (k % every == 0) if every else False
+        # Row-major nonzero lists every routine sample followed by its inserts, in kind order
+        source, kind = np.nonzero(flags)
+        source = np.where(kind >= SamplePlan.KINDS.index("standard"), -1, source)
+        return source, kind.astype(np.int8)
+
+    @staticmethod
+    def sample_ids(numbers, prefix, width=None):
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if numbers.size == 0:
+            return np.empty(0, dtype=f"<U{len(prefix) + 1}")
+        if width is None:
+            width = len(str(int(numbers.max(initial=0))))
+        return np.char.add(prefix, np.char.zfill(numbers.astype(str), width))
+
+    @staticmethod
+    def batch_starts(kind, batch_size):
+        # First row of every lab batch. Batches fill up to batch_size rows but never open on a duplicate,
+        # so a duplicate always shares its parent's batch; with batch_size 1 such a pair makes a batch of two
+        size = kind.size
+        allowed = np.flatnonzero(kind != SamplePlan.KINDS.index("duplicate"))
+        starts = []
+        start = 0
+        while start < size:
+            starts.append(start)
+            if start + batch_size >= size:
+                break
+            index = np.searchsorted(allowed, start + batch_size, side="right") - 1
+            if allowed[index] <= start:
+                index = np.searchsorted(allowed, start, side="right")
+            start = int(allowed[index]) if index < allowed.size else size
+        return np.array(starts, dtype=np.int64)
+
+    @staticmethod
+    def plan(n_samples, prefix="S", first_number=1, duplicate_every=0, standard_every=0, blank_every=0,
+             batch_size=0):
+        source, kind = SamplePlan.sequence(n_samples, duplicate_every, standard_every, blank_every)
+        numbers = first_number + np.arange(source.size)
+        ids = SamplePlan.sample_ids(numbers, prefix)
+        batch_size = int(batch_size) or max(source.size, 1)
+        position = np.arange(source.size)
+        if n_samples == 0:
+            empty = np.empty(0, dtype=np.int32)
+            return {"sample_id": ids, "kind": kind, "source": source, "parent_id": ids.copy(), "batch": empty,
+                    "batch_position": empty, "routine_id": ids.copy(), "routine_batch": empty}
+
+        starts = SamplePlan.batch_starts(kind, batch_size)
+        batch = np.searchsorted(starts, position, side="right")
+        routine = kind == 0
+        sample_id = np.empty(n_samples, dtype=ids.dtype)
+        sample_id[source[routine]] = ids[routine]
+        parent = np.where(kind == SamplePlan.KINDS.index("duplicate"), sample_id[np.maximum(source, 0)], "")
+        return {
+            "sample_id": ids,
+            "kind": kind,
+            "source": source,
+            "parent_id": parent,
+            "batch": batch.astype(np.int32),
+            "batch_position": (position - starts[batch - 1] + 1).astype(np.int32),
+            "routine_id": sample_id,
+            "routine_batch": batch[routine].astype(np.int32),
+        }
+
+    @staticmethod
+    def manifest(plan):
+        # One row per lab batch: first and last sample ID and the count of every kind
+        batch = plan["batch"]
+        n_batches = int(batch.max(initial=0))
+        starts = np.searchsorted(batch, np.arange(1, n_batches + 1))
+        ends = np.searchsorted(batch, np.arange(1, n_batches + 1), side="right") - 1
+        counts = {kind: np.bincount(batch[plan["kind"] == code], minlength=n_batches + 1)[1:]
+                  for code, kind in enumerate(SamplePlan.KINDS)}
+        return {
+            "batch": np.arange(1, n_batches + 1, dtype=np.int32),
+            "first_id": plan["sample_id"][starts],
+            "last_id": plan["sample_id"][ends],
+            "size": (ends - starts + 1).astype(np.int32),
+            **counts,
+        }
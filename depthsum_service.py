@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import argparse
+import collections
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from depthsum_engine import ProfileEngine
+from depthsum_pool import process_pool
+
+
+# Collars per streamed chunk
+STREAM_CHUNK = 50000
+
+
+def plan_design(request):
+    # Runs in a pool worker; the request is plain JSON so it pickles cheaply
+    rings = [np.asarray(ring, dtype=np.float64) for ring in request["rings"]]
+    xy = np.concatenate(rings)
+    x_min, y_min = xy.min(axis=0)
+    x_max, y_max = xy.max(axis=0)
+    # The lattice is anchored on the area centroid, as the toolbox anchors it, so both place the same collars
+    origin = request.get("origin") or ProfileEngine.centroid(rings)
+    grid = ProfileEngine.clip_profiles(rings, origin, x_max - x_min, y_max - y_min, request["spacing"],
+                                       request["azimuth"], request["interval"], workers=1)
+    x, y = grid.collar_world()
+    depth = request.get("avg_depth") or 0
+    counts = grid.collar_counts()
+    return {
+        "summary": {
+            "profiles": int(grid.n_profiles),
+            "collars": int(grid.n_collars),
+            "total_length": float(grid.profile_lengths.sum()),
+            "total_meterage": float(counts.sum() * depth),
+        },
+        "profiles": {"id": grid.profile_ids.tolist(), "length": np.round(grid.profile_lengths, 2).tolist(),
+                     "collars": counts.tolist()},
+        "col_ids": grid.col_ids,
+        "col_x": x,
+        "col_y": y,
+    }
+
+
+def warm_up():
+    # Forces the engine import and a tiny clip in every worker before the first real request
+    plan_design({"rings": [[[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]], "spacing": 5, "azimuth": 0,
+                 "interval": 5})
+    return os.getpid()
+
+
+class ResultCache:
+    # Results shared by every client of the service, least recently used evicted first. The cache is
+    # bounded by entries and by the collars held across them, since one large block can outweigh
+    # many small ones; a result larger than the whole collar budget is returned but not kept
+    def __init__(self, max_entries=64, max_collars=20000000):
+        self.max_entries = max_entries
+        self.max_collars = max_collars
+        self.collars = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(request):
+        return hashlib.sha1(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        size = int(result["col_ids"].size)
+        if size > self.max_collars:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.collars -= int(previous["col_ids"].size)
+            self.entries[key] = result
+            self.collars += size
+            while len(self.entries) > self.max_entries or self.collars > self.max_collars:
+                _, evicted = self.entries.popitem(last=False)
+                self.collars -= int(evicted["col_ids"].size)
+
+
+class PlanningService:
+    def __init__(self, workers=None, cache_entries=64, cache_collars=20000000):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.pool = process_pool(self.workers)
+        self.cache = ResultCache(cache_entries, cache_collars)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # One warm-up task per worker so the pool is started and imported before requests arrive
+        for future in [self.pool.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def plan(self, request):
+        key = ResultCache.key(request)
+        result = self.cache.get(key)
+        if result is not None:
+            return result, True
+        # Identical requests in flight share one computation
+        with self.pending_lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pool.submit(plan_design, request)
+                self.pending[key] = future
+        try:
+            result = future.result()
+        finally:
+            with self.pending_lock:
+                self.pending.pop(key, None)
+        self.cache.put(key, result)
+        return result, False
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class PlanningHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        cache = self.service.cache
+        self.send_json(200, {"status": "ok", "workers": self.service.workers, "cached": len(cache.entries),
+                             "cached_collars": cache.collars, "hits": cache.hits, "misses": cache.misses})
+
+    def do_POST(self):
+        if self.path != "/plan":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            for name in ("rings", "spacing", "azimuth", "interval"):
+                if name not in request:
+                    raise ValueError(f"missing {name}")
+            started = time.perf_counter()
+            result, cached = self.service.plan(request)
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        # NDJSON over chunked transfer: summary and profiles first, then collars in chunks
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.write_chunk({"type": "summary", "cached": cached, "elapsed_ms": (time.perf_counter() - started) * 1000.0,
+                          **result["summary"]})
+        self.write_chunk({"type": "profiles", **result["profiles"]})
+        for start in range(0, result["col_ids"].size, STREAM_CHUNK):
+            end = start + STREAM_CHUNK
+            self.write_chunk({"type": "collars", "profile": result["col_ids"][start:end].tolist(),
+                              "x": result["col_x"][start:end].tolist(), "y": result["col_y"][start:end].tolist()})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class PlanningClient:
+    # Stand-in client: posts a request and reassembles the streamed records
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def health(self):
+        with urllib.request.urlopen(self.url + "/health") as response:
+            return json.loads(response.read())
+
+    def plan(self, rings, spacing, azimuth, interval, avg_depth=None):
+        body = json.dumps({"rings": rings, "spacing": spacing, "azimuth": azimuth, "interval": interval,
+                           "avg_depth": avg_depth}).encode("utf-8")
+        request = urllib.request.Request(self.url + "/plan", data=body, headers={"Content-Type": "application/json"})
+        summary, profiles, collars = None, None, {"profile": [], "x": [], "y": []}
+        with urllib.request.urlopen(request) as response:
+            for line in response:
+                record = json.loads(line)
+                if record["type"] == "summary":
+                    summary = record
+                elif record["type"] == "profiles":
+                    profiles = record
+                else:
+                    for key in collars:
+                        collars[key].extend(record[key])
+        return summary, profiles, {key: np.asarray(values) for key, values in collars.items()}
+
+
+def serve(host, port, workers, cache_entries=64, cache_collars=20000000):
+    service = PlanningService(workers, cache_entries, cache_collars)
+    handler = type("BoundPlanningHandler", (PlanningHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, service
+
+
+def self_test(workers):
+    # Starts the service on a free port and runs a synthetic block through the stand-in client
+    server, service = serve("127.0.0.1", 0, workers)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = PlanningClient(f"http://127.0.0.1:{server.server_address[1]}")
+        angles = np.linspace(0.0, 2.0 * np.pi, 2001)
+        ring = np.column_stack([500000 + 3000 * np.cos(angles), 6000000 - 2000 * np.sin(angles)]).tolist()
+        summary, profiles, collars = client.plan([ring], 100, 30, 25, 50)
+        again, _, _ = client.plan([ring], 100, 30, 25, 50)
+        ok = (summary["collars"] == collars["x"].size == sum(profiles["collars"]) and again["cached"]
+              and summary["collars"] > 0)
+        print(f"first request: {summary['elapsed_ms']:.1f} ms, {summary['profiles']} profiles, "
+              f"{summary['collars']} collars; cached request: {again['elapsed_ms']:.1f} ms")
+        print(f"health: {client.health()}")
+        print("PASS" if ok else "FAIL")
+        return 0 if ok else 1
+    finally:
+        server.shutdown()
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local planning service around the in-process engine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-entries", type=int, default=64)
+    parser.add_argument("--cache-collars", type=int, default=20000000,
+                        help="collars held across all cached results")
+    parser.add_argument("--self-test", action="store_true")
+    args = parser.parse_args()
+
+    if args.self_test:
+        return self_test(args.workers or 2)
+    server, service = serve(args.host, args.port, args.workers, args.cache_entries, args.cache_collars)
+    print(f"Planning service on http://{args.host}:{server.server_address[1]} with {service.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
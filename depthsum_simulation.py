@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from depthsum_pool import process_pool
+
+
+class MeterageSimulator:
+    # Byte budget for one hole x trial block of the depth matrix
+    CHUNK_BYTES = 64 * 1024 * 1024
+    # Trials per random stream; fixed so results for a seed are the same with any worker count
+    TRIAL_CHUNK = 1000
+
+    @staticmethod
+    def draw_depths(rng, distribution, avg_depth, depth_sd, empirical, shape):
+        if distribution == "Lognormal":
+            sigma2 = math.log(1.0 + (depth_sd / avg_depth) ** 2)
+            mu = math.log(avg_depth) - sigma2 / 2.0
+            depths = rng.standard_normal(shape)
+            depths *= math.sqrt(sigma2)
+            depths += mu
+            return np.exp(depths, out=depths)
+        if distribution == "Normal":
+            depths = rng.standard_normal(shape)
+            depths *= depth_sd
+            depths += avg_depth
+            return np.maximum(depths, 0.0, out=depths)
+        if distribution == "Uniform":
+            half = depth_sd * math.sqrt(3.0)
+            return rng.uniform(max(avg_depth - half, 0.0), avg_depth + half, shape)
+        if distribution == "Empirical":
+            return empirical[rng.integers(0, empirical.size, shape)]
+        return np.full(shape, float(avg_depth))
+
+    @staticmethod
+    def simulate_trials(n_holes, n_trials, distribution, avg_depth, depth_sd, empirical, seed):
+        rng = np.random.default_rng(seed)
+        totals = np.zeros(n_trials)
+        chunk = max(1, MeterageSimulator.CHUNK_BYTES // (8 * max(n_trials, 1)))
+        for start in range(0, n_holes, chunk):
+            rows = min(chunk, n_holes - start)
+            depths = MeterageSimulator.draw_depths(rng, distribution, avg_depth, depth_sd, empirical,
+                                                   (rows, n_trials))
+            totals += depths.sum(axis=0)
+        return totals
+
+    @staticmethod
+    def simulate(n_holes, n_trials, distribution, avg_depth, depth_sd=0.0, empirical=None,
+                 workers=1, seed=None):
+        if empirical is not None:
+            empirical = np.asarray(empirical, dtype=np.float64)
+            empirical = empirical[np.isfinite(empirical)]
+            if empirical.size == 0:
+                raise ValueError("Empirical depth sample is empty")
+        elif distribution == "Empirical":
+            raise ValueError("Empirical distribution requires past campaign depths")
+        if distribution in ("Lognormal", "Normal", "Uniform") and not avg_depth:
+            raise ValueError(f"{distribution} distribution requires an average depth")
+
+        # Every block of TRIAL_CHUNK trials draws from its own stream spawned from the seed, so the
+        # totals for a seed do not depend on how many workers share the blocks
+        seeds = np.random.SeedSequence(seed).spawn(max(1, math.ceil(n_trials / MeterageSimulator.TRIAL_CHUNK)))
+        counts = [min(MeterageSimulator.TRIAL_CHUNK, n_trials - start)
+                  for start in range(0, n_trials, MeterageSimulator.TRIAL_CHUNK)]
+        args = [(n_holes, count, distribution, avg_depth, depth_sd, empirical, s) for count, s in zip(counts, seeds)]
+
+        workers = max(1, min(int(workers or 1), len(args)))
+        if workers == 1:
+            parts = [MeterageSimulator.simulate_trials(*arg) for arg in args]
+        else:
+            with process_pool(workers) as pool:
+                parts = list(pool.map(MeterageSimulator.simulate_trials, *zip(*args)))
+        return np.concatenate(parts)
+
+    @staticmethod
+    def new_seed():
+        # Fresh seed, small enough to be entered back as a Long tool parameter to repeat a run
+        return int(np.random.SeedSequence().generate_state(1)[0] & 0x7FFFFFFF)
+
+    @staticmethod
+    def summarize(totals):
+        p10, p50, p90 = np.percentile(totals, [10, 50, 90])
+        return {
+            "trials": int(totals.size),
+            "mean": float(totals.mean()),
+            "std": float(totals.std()),
+            "P10": float(p10),
+            "P50": float(p50),
+            "P90": float(p90),
+        }
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class HashGrid:
+    # Self cell plus half of the 8-neighbourhood, so every neighbouring cell pair is visited once
+    NEIGHBOURS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+    @staticmethod
+    def cell_keys(x, y, cell):
+        ix = np.floor(np.asarray(x, dtype=np.float64) / cell).astype(np.int64)
+        iy = np.floor(np.asarray(y, dtype=np.float64) / cell).astype(np.int64)
+        if ix.size == 0:
+            return ix, 1
+        ix -= ix.min()
+        iy -= iy.min()
+        # Two spare rows per column keep iy - 1 and iy + 1 from aliasing an occupied cell
+        stride = int(iy.max()) + 2
+        return ix * stride + iy, stride
+
+    @staticmethod
+    def neighbour_pairs(x, y, tolerance):
+        # Index pairs (i, j), i != j, closer than tolerance; linear in the number of points for
+        # bounded cell occupancy
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        keys, stride = HashGrid.cell_keys(x, y, tolerance)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        cells, starts, counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+
+        first, second = [], []
+        for dx, dy in HashGrid.NEIGHBOURS:
+            target = cells + dx * stride + dy
+            pos = np.minimum(np.searchsorted(cells, target), cells.size - 1)
+            found = np.flatnonzero(cells[pos] == target)
+            a_cell, b_cell = found, pos[found]
+            # Every point of cell a against every point of cell b
+            n_pairs = counts[a_cell] * counts[b_cell]
+            pair_cell = np.repeat(np.arange(a_cell.size), n_pairs)
+            local = np.arange(pair_cell.size) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+            b_count = counts[b_cell][pair_cell]
+            i = order[starts[a_cell][pair_cell] + local // b_count]
+            j = order[starts[b_cell][pair_cell] + local % b_count]
+            if dx == 0 and dy == 0:
+                keep = i < j
+                i, j = i[keep], j[keep]
+            close = np.hypot(x[i] - x[j], y[i] - y[j]) <= tolerance
+            first.append(i[close])
+            second.append(j[close])
+        return np.concatenate(first), np.concatenate(second)
+
+    @staticmethod
+    def groups(x, y, tolerance):
+        # scipy is imported here so the engine stays light enough for parameter validation
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        n = np.asarray(x).size
+        i, j = HashGrid.neighbour_pairs(x, y, tolerance)
+        graph = coo_matrix((np.ones(i.size, dtype=np.int8), (i, j)), shape=(n, n))
+        return connected_components(graph, directed=False)[1]
+
+    @staticmethod
+    def dedupe(x, y, tolerance, priority=None):
+        # Keep one point per group of coinciding points: highest priority, then lowest index
+        n = np.asarray(x).size
+        labels = HashGrid.groups(x, y, tolerance)
+        priority = np.zeros(n) if priority is None else np.asarray(priority, dtype=np.float64)
+        order = np.lexsort((np.arange(n), -priority, labels))
+        keep = np.zeros(n, dtype=bool)
+        first_of_group = np.ones(n, dtype=bool)
+        first_of_group[1:] = labels[order][1:] != labels[order][:-1]
+        keep[order[first_of_group]] = True
+        return keep, labels
+
+    @staticmethod
+    def merge(x, y, tolerance, fixed=None):
+        # Collapse points within tolerance. A group touching a fixed point (e.g. a collar of an
+        # adjacent block) keeps that point in place; other groups keep their first point, moved to
+        # the group mean. Returns the keep mask, the kept representative of every point and the
+        # merged coordinates of every point's group
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n = x.size
+        fixed = np.zeros(n, dtype=bool) if fixed is None else np.asarray(fixed, dtype=bool)
+        labels = HashGrid.groups(x, y, tolerance)
+
+        order = np.lexsort((np.arange(n), ~fixed, labels))
+        first_of_group = np.ones(n, dtype=bool)
+        first_of_group[1:] = labels[order][1:] != labels[order][:-1]
+        representative = np.empty(labels.max() + 1 if n else 0, dtype=np.int64)
+        representative[labels[order[first_of_group]]] = order[first_of_group]
+        keep = np.zeros(n, dtype=bool)
+        keep[representative] = True
+
+        size = np.bincount(labels, minlength=representative.size)
+        has_fixed = np.bincount(labels, weights=fixed, minlength=representative.size) > 0
+        merged_x = np.where(has_fixed, x[representative], np.bincount(labels, weights=x) / size)
+        merged_y = np.where(has_fixed, y[representative], np.bincount(labels, weights=y) / size)
+        return keep, representative[labels], merged_x[labels], merged_y[labels]
+
+
+class AccessMask:
+    # Upper bound on collar x candidate cells tested at once by relocate
+    CHUNK_CELLS = 4 * 1024 * 1024
+
+    def __init__(self, good, x_min, y_max, cell_width, cell_height):
+        from scipy.ndimage import distance_transform_edt
+
+        # good: boolean raster, row 0 at y_max; the distance transform is computed once per raster
+        self.good = np.asarray(good, dtype=bool)
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.cell_width = float(cell_width)
+        self.cell_height = float(cell_height)
+        self.distance = distance_transform_edt(~self.good, sampling=(self.cell_height, self.cell_width))
+
+    @staticmethod
+    def from_raster_array(values, x_min, y_max, cell_width, cell_height, max_value=None):
+        # Slope raster: cells up to max_value are drillable. No-go raster (max_value None): zero cells are
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            good = values <= max_value if max_value is not None else values == 0
+        return AccessMask(good & np.isfinite(values), x_min, y_max, cell_width, cell_height)
+
+    def cells(self, x, y):
+        col = np.floor((np.asarray(x) - self.x_min) / self.cell_width).astype(np.int64)
+        row = np.floor((self.y_max - np.asarray(y)) / self.cell_height).astype(np.int64)
+        inside = (row >= 0) & (row < self.good.shape[0]) & (col >= 0) & (col < self.good.shape[1])
+        return np.where(inside, row, 0), np.where(inside, col, 0), inside
+
+    def is_good(self, x, y):
+        row, col, inside = self.cells(x, y)
+        return inside & self.good[row, col]
+
+    def relocate(self, x, y, dir_x, dir_y, max_distance):
+        # Move collars on no-go cells to the nearest drillable cell along their profile direction.
+        # Collars outside the raster are unknown rather than no-go and stay where they are. Returns
+        # new x, y, a mask of collars that could not be placed within max_distance and a mask of
+        # collars outside the raster
+        x = np.asarray(x, dtype=np.float64).copy()
+        y = np.asarray(y, dtype=np.float64).copy()
+        row, col, inside = self.cells(x, y)
+        bad = np.flatnonzero(inside & ~self.good[row, col])
+
+        # The distance transform (between cell centres, less one cell diagonal) bounds any move from
+        # below, so collars with no drillable cell in reach are dropped without a search
+        slack = np.hypot(self.cell_width, self.cell_height)
+        reachable = self.distance[row[bad], col[bad]] - slack <= max_distance
+        dropped = np.zeros(x.size, dtype=bool)
+        dropped[bad[~reachable]] = True
+        bad = bad[reachable]
+
+        step = min(self.cell_width, self.cell_height) / 2.0
+        n_steps = max(int(np.ceil(max_distance / step)), 1)
+        # Candidate offsets ordered by distance, the forward direction first on ties
+        offsets = np.repeat(np.arange(1, n_steps + 1) * step, 2) * np.tile([1.0, -1.0], n_steps)
+        offsets = offsets[np.abs(offsets) <= max_distance]
+
+        chunk = max(1, AccessMask.CHUNK_CELLS // max(offsets.size, 1))
+        dir_x = np.asarray(dir_x, dtype=np.float64)
+        dir_y = np.asarray(dir_y, dtype=np.float64)
+        for start in range(0, bad.size, chunk):
+            part = bad[start:start + chunk]
+            cand_x = x[part, None] + offsets[None, :] * dir_x[part, None]
+            cand_y = y[part, None] + offsets[None, :] * dir_y[part, None]
+            ok = self.is_good(cand_x, cand_y)
+            found = ok.any(axis=1)
+            choice = ok.argmax(axis=1)
+
+            moved = part[found]
+            x[moved] = cand_x[found, choice[found]]
+            y[moved] = cand_y[found, choice[found]]
+            dropped[part[~found]] = True
+        return x, y, dropped, ~inside
+
+    @staticmethod
+    def profile_directions(x, y, profile, order_key, azimuth=None):
+        # Unit vector along each collar's profile from its neighbours on the same profile
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        profile = np.asarray(profile)
+        order = np.lexsort((np.asarray(order_key), profile))
+        xs, ys, ps = x[order], y[order], profile[order]
+        prev = np.concatenate([[0], np.arange(xs.size - 1)])
+        nxt = np.concatenate([np.arange(1, xs.size), [max(xs.size - 1, 0)]])
+        prev = np.where(ps[prev] == ps, prev, np.arange(xs.size))
+        nxt = np.where(ps[nxt] == ps, nxt, np.arange(xs.size))
+        dx = xs[nxt] - xs[prev]
+        dy = ys[nxt] - ys[prev]
+        norm = np.hypot(dx, dy)
+        if azimuth is None:
+            fallback_x, fallback_y = 0.0, 1.0
+        else:
+            fallback_x, fallback_y = np.sin(np.radians(azimuth)), np.cos(np.radians(azimuth))
+        single = norm == 0
+        dir_x = np.where(single, fallback_x, dx / np.where(single, 1.0, norm))
+        dir_y = np.where(single, fallback_y, dy / np.where(single, 1.0, norm))
+        result_x = np.empty_like(dir_x)
+        result_y = np.empty_like(dir_y)
+        result_x[order] = dir_x
+        result_y[order] = dir_y
+        return result_x, result_y
+
+
+class RingSimplifier:
+    @staticmethod
+    def segment_distance(px, py, ax, ay, bx, by):
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip(((px - ax) * dx + (py - ay) * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        return np.hypot(px - ax - t * dx, py - ay - t * dy)
+
+    @staticmethod
+    def group_argmax(values, group, offsets):
+        # Position of the first maximum of every contiguous group
+        maxima = np.maximum.reduceat(values, offsets)
+        candidates = np.flatnonzero(values == maxima[group])
+        _, first = np.unique(group[candidates], return_index=True)
+        return candidates[first], maxima
+
+    @staticmethod
+    def simplify(rings, tolerance):
+        # Douglas-Peucker on all rings at once: every pass splits all open spans whose farthest vertex
+        # lies more than tolerance from the span's chord, so no removed vertex ends up farther than
+        # tolerance from the simplified boundary. Rings are closed; each is first split at the vertex
+        # farthest from its start. Rings shorter than a closed triangle are returned as they are
+        all_rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings]
+        rings = [ring for ring in all_rings if len(ring) >= 4]
+        if not rings:
+            return all_rings
+        sizes = np.array([len(ring) for ring in rings])
+        xy = np.concatenate(rings)
+        x, y = xy[:, 0], xy[:, 1]
+        first = np.cumsum(sizes) - sizes
+        last = first + sizes - 1
+        ring_of = np.repeat(np.arange(sizes.size), sizes)
+
+        far, _ = RingSimplifier.group_argmax(np.hypot(x - x[first][ring_of], y - y[first][ring_of]),
+                                              ring_of, first)
+        keep = np.zeros(xy.shape[0], dtype=bool)
+        keep[first] = keep[last] = keep[far] = True
+        starts = np.concatenate([first, far])
+        ends = np.concatenate([far, last])
+
+        while starts.size:
+            spans = ends - starts - 1
+            active = spans > 0
+            starts, ends, spans = starts[active], ends[active], spans[active]
+            if not starts.size:
+                break
+            offsets = np.cumsum(spans) - spans
+            owner = np.repeat(np.arange(starts.size), spans)
+            index = starts[owner] + 1 + np.arange(owner.size) - offsets[owner]
+            distance = RingSimplifier.segment_distance(x[index], y[index], x[starts[owner]], y[starts[owner]],
+                                                       x[ends[owner]], y[ends[owner]])
+            position, maxima = RingSimplifier.group_argmax(distance, owner, offsets)
+            split = maxima > tolerance
+            pivot = index[position[split]]
+            keep[pivot] = True
+            starts = np.concatenate([starts[split], pivot])
+            ends = np.concatenate([pivot, ends[split]])
+
+        simplified, ring_index = [], 0
+        for ring in all_rings:
+            if len(ring) < 4:
+                simplified.append(ring)
+                continue
+            ring_keep = keep[first[ring_index]:last[ring_index] + 1]
+            # A ring reduced below a triangle is kept as digitised
+            simplified.append(ring[ring_keep] if ring_keep.sum() >= 4 else ring)
+            ring_index += 1
+        return simplified
+
+    @staticmethod
+    def measure(rings):
+        perimeter, area = 0.0, 0.0
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)
+            if len(ring) < 2:
+                continue
+            dx, dy = ring[:, 0] - ring[0, 0], ring[:, 1] - ring[0, 1]
+            perimeter += float(np.hypot(np.diff(dx), np.diff(dy)).sum())
+            area += float(np.sum(dx[:-1] * dy[1:] - dx[1:] * dy[:-1])) / 2.0
+        return perimeter, abs(area)
+
+    @staticmethod
+    def effect(rings, simplified, tolerance, spacing, interval):
+        # The simplified boundary stays within tolerance of the original, so the area gained or lost
+        # is at most perimeter x tolerance and the profile length clipped by it at most that / spacing.
+        # Collars also move by one wherever a shifted span end passes a collar position, so the collar
+        # estimate adds one per boundary crossing, 2 x perimeter / (pi x spacing) on average over
+        # azimuths; it is an estimate of the spread, not a bound
+        perimeter, area = RingSimplifier.measure(rings)
+        new_perimeter, new_area = RingSimplifier.measure(simplified)
+        worst_length = max(perimeter, new_perimeter) * tolerance / spacing
+        crossings = 2.0 * new_perimeter / (np.pi * spacing)
+        return {
+            "vertices": int(sum(len(ring) for ring in rings)),
+            "simplified_vertices": int(sum(len(ring) for ring in simplified)),
+            "area_change": new_area - area,
+            "length_change": (new_area - area) / spacing,
+            "worst_length_change": worst_length,
+            "boundary_crossings": float(crossings),
+            "collar_change_estimate": int(np.ceil(worst_length / interval + crossings)),
+        }
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import struct
+
+import numpy as np
+
+from depthsum_pool import process_pool
+
+
+class TilePyramid:
+    # z/x/y quadtree over Web Mercator. Each tile is one binary file: b"DST1", uint32 point count,
+    # uint32 segment count, uint16 point x and y in EXTENT units from the tile's top-left corner,
+    # int32 point profile numbers, int32 segment x1, y1, x2, y2 (may leave the tile) and int32
+    # segment profile numbers, all little-endian
+    MAGIC = b"DST1"
+    EXTENT = 4096
+    HALF_WORLD = 20037508.342789244
+    # Below the deepest zoom collars are thinned to one per cell of a THIN_CELLS x THIN_CELLS tile grid
+    THIN_CELLS = 128
+    # Tiles of one zoom are split into this many column bands per worker so deep zooms spread evenly
+    BANDS_PER_WORKER = 4
+    # Collars and segments of the pyramid being built, set in each pool worker by share
+    SHARED = None
+
+    @staticmethod
+    def world_units(x, y, zoom):
+        # Mercator metres -> tile units: tile index in the integer part, EXTENT steps in the fraction
+        scale = (1 << zoom) / (2.0 * TilePyramid.HALF_WORLD)
+        return ((np.asarray(x, dtype=np.float64) + TilePyramid.HALF_WORLD) * scale,
+                (TilePyramid.HALF_WORLD - np.asarray(y, dtype=np.float64)) * scale)
+
+    @staticmethod
+    def thin(tile_x, tile_y, cells):
+        # First point of every thinning cell, in input order
+        cell_x = np.floor(tile_x * cells).astype(np.int64)
+        cell_y = np.floor(tile_y * cells).astype(np.int64)
+        cell_x -= cell_x.min(initial=0)
+        cell_y -= cell_y.min(initial=0)
+        key = cell_x * (int(cell_y.max(initial=0)) + 1) + cell_y
+        order = np.argsort(key, kind="stable")
+        first = np.ones(key.size, dtype=bool)
+        first[1:] = key[order[1:]] != key[order[:-1]]
+        return np.sort(order[first])
+
+    @staticmethod
+    def segment_tiles(ux1, uy1, ux2, uy2):
+        # Every tile a segment passes through: returns segment index, tile x and tile y. Segments are
+        # split into the tile columns they span, and each column piece covers only the rows between
+        # the segment's heights at the column edges, so a long diagonal costs its length, not its bbox
+        x_lo, x_hi = np.minimum(ux1, ux2), np.maximum(ux1, ux2)
+        tx0 = np.floor(x_lo).astype(np.int64)
+        width = np.floor(x_hi).astype(np.int64) - tx0 + 1
+        segment = np.repeat(np.arange(width.size), width)
+        column = tx0[segment] + np.arange(segment.size) - np.repeat(np.cumsum(width) - width, width)
+
+        left = np.maximum(x_lo[segment], column)
+        right = np.minimum(x_hi[segment], column + 1)
+        dx = (ux2 - ux1)[segment]
+        slope = np.where(dx == 0, 0.0, (uy2 - uy1)[segment] / np.where(dx == 0, 1.0, dx))
+        y_left = np.where(dx == 0, uy1[segment], uy1[segment] + (left - ux1[segment]) * slope)
+        y_right = np.where(dx == 0, uy2[segment], uy1[segment] + (right - ux1[segment]) * slope)
+        # Heights are kept within the segment's own rows so rounding never adds a tile
+        y_min, y_max = np.minimum(uy1, uy2)[segment], np.maximum(uy1, uy2)[segment]
+        ty0 = np.floor(np.clip(np.minimum(y_left, y_right), y_min, y_max)).astype(np.int64)
+        ty1 = np.floor(np.clip(np.maximum(y_left, y_right), y_min, y_max)).astype(np.int64)
+
+        height = ty1 - ty0 + 1
+        piece = np.repeat(np.arange(height.size), height)
+        row = ty0[piece] + np.arange(piece.size) - np.repeat(np.cumsum(height) - height, height)
+        return segment[piece], column[piece], row
+
+    @staticmethod
+    def encode(px, py, p_profile, sx1, sy1, sx2, sy2, s_profile):
+        return b"".join([
+            TilePyramid.MAGIC,
+            struct.pack("<II", px.size, sx1.size),
+            px.astype("<u2").tobytes(), py.astype("<u2").tobytes(), p_profile.astype("<i4").tobytes(),
+            np.column_stack([sx1, sy1, sx2, sy2]).astype("<i4").tobytes(), s_profile.astype("<i4").tobytes(),
+        ])
+
+    @staticmethod
+    def decode(data):
+        if data[:4] != TilePyramid.MAGIC:
+            raise ValueError("Not a DepthSum tile")
+        n_points, n_segments = struct.unpack_from("<II", data, 4)
+        offset = 12
+        arrays = []
+        for dtype, count in (("<u2", n_points), ("<u2", n_points), ("<i4", n_points), ("<i4", 4 * n_segments),
+                             ("<i4", n_segments)):
+            arrays.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+            offset += count * np.dtype(dtype).itemsize
+        segments = arrays[3].reshape(-1, 4)
+        return {"x": arrays[0], "y": arrays[1], "profile": arrays[2], "segments": segments, "seg_profile": arrays[4]}
+
+    @staticmethod
+    def write_band(folder, zoom, points, segments):
+        # points: tile key, quantised x, y and profile; segments: tile key, quantised ends and profile.
+        # Tile keys are tile x << zoom | tile y; both sets are grouped by key and written one file per tile
+        p_key, px, py, p_profile = points
+        s_key, sx1, sy1, sx2, sy2, s_profile = segments
+        p_order = np.argsort(p_key, kind="stable")
+        s_order = np.argsort(s_key, kind="stable")
+        p_sorted, s_sorted = p_key[p_order], s_key[s_order]
+        tiles = np.union1d(p_sorted, s_sorted)
+        p_bounds = np.searchsorted(p_sorted, np.append(tiles, tiles[-1] + 1) if tiles.size else tiles)
+        s_bounds = np.searchsorted(s_sorted, np.append(tiles, tiles[-1] + 1) if tiles.size else tiles)
+        mask = (1 << zoom) - 1
+        for index, key in enumerate(tiles.tolist()):
+            p = p_order[p_bounds[index]:p_bounds[index + 1]]
+            s = s_order[s_bounds[index]:s_bounds[index + 1]]
+            path = os.path.join(folder, str(zoom), str(key >> zoom))
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, f"{key & mask}.bin"), "wb") as file:
+                file.write(TilePyramid.encode(px[p], py[p], p_profile[p], sx1[s], sy1[s], sx2[s], sy2[s],
+                                              s_profile[s]))
+        return int(tiles.size)
+
+    @staticmethod
+    def share(x, y, profile, segments):
+        # Pool initializer: every worker receives the collars and segments once, tasks name only a band
+        TilePyramid.SHARED = (x, y, profile, segments)
+
+    @staticmethod
+    def band_payload(zoom, max_zoom, band, n_bands, x, y, profile, segments):
+        # Quantised, thinned points and clipped segment copies of the tile columns in one band (column
+        # index % n_bands == band). Thinning cells never span two tile columns, so thinning the band
+        # alone keeps the same points as thinning the whole zoom
+        ux, uy = TilePyramid.world_units(x, y, zoom)
+        ptx = np.floor(ux).astype(np.int64)
+        p = ptx % n_bands == band
+        ux, uy, profile, ptx = ux[p], uy[p], profile[p], ptx[p]
+        if zoom < max_zoom:
+            keep = TilePyramid.thin(ux, uy, TilePyramid.THIN_CELLS)
+            ux, uy, profile, ptx = ux[keep], uy[keep], profile[keep], ptx[keep]
+        pty = np.floor(uy).astype(np.int64)
+        px = np.minimum((ux - ptx) * TilePyramid.EXTENT, TilePyramid.EXTENT - 1)
+        py = np.minimum((uy - pty) * TilePyramid.EXTENT, TilePyramid.EXTENT - 1)
+
+        sx1, sy1, sx2, sy2, s_profile = segments
+        ux1, uy1 = TilePyramid.world_units(sx1, sy1, zoom)
+        ux2, uy2 = TilePyramid.world_units(sx2, sy2, zoom)
+        # Segments shorter than a thinning cell vanish at this zoom; of the rest only those spanning a
+        # column of this band are split into tiles
+        tx0 = np.floor(np.minimum(ux1, ux2)).astype(np.int64)
+        span = np.floor(np.maximum(ux1, ux2)).astype(np.int64) - tx0
+        s = (span >= n_bands - 1) | ((band - tx0) % n_bands <= span)
+        if zoom < max_zoom:
+            s &= np.hypot(ux2 - ux1, uy2 - uy1) * TilePyramid.THIN_CELLS >= 1.0
+        ux1, uy1, ux2, uy2, s_profile = ux1[s], uy1[s], ux2[s], uy2[s], s_profile[s]
+        segment, stx, sty = TilePyramid.segment_tiles(ux1, uy1, ux2, uy2)
+        t = stx % n_bands == band
+        segment, stx, sty = segment[t], stx[t], sty[t]
+        quantised = [np.round((u[segment] - tile) * TilePyramid.EXTENT)
+                     for u, tile in ((ux1, stx), (uy1, sty), (ux2, stx), (uy2, sty))]
+        return (((ptx << zoom) | pty, px, py, profile),
+                ((stx << zoom) | sty, *quantised, s_profile[segment]))
+
+    @staticmethod
+    def build_band(folder, zoom, max_zoom, band, n_bands):
+        # Pool task: thinning, tiling and writing of one band run in the worker on the shared arrays
+        payload = TilePyramid.band_payload(zoom, max_zoom, band, n_bands, *TilePyramid.SHARED)
+        return TilePyramid.write_band(folder, zoom, *payload)
+
+    @staticmethod
+    def build(folder, x, y, profile, segments, min_zoom, max_zoom, workers=None):
+        # x, y: collar Web Mercator coordinates; segments: x1, y1, x2, y2 and profile of every profile segment
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        profile = np.asarray(profile, dtype=np.int64)
+        segments = tuple(np.asarray(part) for part in segments)
+        workers = max(1, int(workers or os.cpu_count() or 1))
+        n_bands = workers * TilePyramid.BANDS_PER_WORKER
+
+        tiles_per_zoom = {}
+        if workers == 1:
+            for zoom in range(min_zoom, max_zoom + 1):
+                payload = TilePyramid.band_payload(zoom, max_zoom, 0, 1, x, y, profile, segments)
+                tiles_per_zoom[zoom] = TilePyramid.write_band(folder, zoom, *payload)
+        else:
+            # Tasks are only (zoom, band) descriptors, so the parent holds no tile payloads at all
+            with process_pool(workers, TilePyramid.share, (x, y, profile, segments)) as pool:
+                futures = [(zoom, pool.submit(TilePyramid.build_band, folder, zoom, max_zoom, band, n_bands))
+                           for zoom in range(min_zoom, max_zoom + 1) for band in range(n_bands)]
+                for zoom, future in futures:
+                    tiles_per_zoom[zoom] = tiles_per_zoom.get(zoom, 0) + future.result()
+
+        metadata = {
+            "format": "depthsum-tile-v1",
+            "scheme": "xyz",
+            "extent": TilePyramid.EXTENT,
+            "min_zoom": min_zoom,
+            "max_zoom": max_zoom,
+            "bounds_mercator": [float(x.min(initial=0)), float(y.min(initial=0)),
+                                float(x.max(initial=0)), float(y.max(initial=0))],
+            "collars": int(x.size),
+            "segments": int(segments[0].size),
+            "tiles": {str(zoom): count for zoom, count in tiles_per_zoom.items()},
+        }
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "metadata.json"), "w", encoding="utf-8") as file:
+            json.dump(metadata, file, indent=2)
+        return metadata
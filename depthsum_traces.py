@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class HoleTrace:
+    @staticmethod
+    def hole_length(depth, dip, vertical_depth=False):
+        # Along-hole length of a straight hole; dip is measured down from horizontal, 90 is vertical
+        dip_values = np.asarray(dip, dtype=np.float64)
+        if np.any((dip_values <= 0) | (dip_values > 90)):
+            raise ValueError("Hole dip must be above 0 and at most 90 degrees")
+        depth = np.asarray(depth, dtype=np.float64)
+        if not vertical_depth:
+            return depth
+        return depth / np.sin(np.radians(dip_values))
+
+    @staticmethod
+    def direction(dip, azimuth):
+        dip = np.radians(np.asarray(dip, dtype=np.float64))
+        azimuth = np.radians(np.asarray(azimuth, dtype=np.float64))
+        return np.cos(dip) * np.sin(azimuth), np.cos(dip) * np.cos(azimuth), -np.sin(dip)
+
+    @staticmethod
+    def end_points(x, y, z, dip, azimuth, length):
+        dx, dy, dz = HoleTrace.direction(dip, azimuth)
+        length = np.asarray(length, dtype=np.float64)
+        return (np.asarray(x, dtype=np.float64) + dx * length,
+                np.asarray(y, dtype=np.float64) + dy * length,
+                np.asarray(z, dtype=np.float64) + dz * length)
+
+    @staticmethod
+    def stations(x, y, z, dip, azimuth, length, survey_interval=None):
+        # Survey stations every survey_interval down each hole plus the collar and the end of hole.
+        # Scalars broadcast over all holes; stations come grouped by hole in downhole order.
+        # Returns hole index, downhole depth and x, y, z of every station
+        x = np.asarray(x, dtype=np.float64)
+        n_holes = x.size
+        y = np.broadcast_to(np.asarray(y, dtype=np.float64), n_holes)
+        z = np.broadcast_to(np.asarray(z, dtype=np.float64), n_holes)
+        length = np.broadcast_to(np.asarray(length, dtype=np.float64), n_holes)
+        dx, dy, dz = (np.broadcast_to(part, n_holes) for part in HoleTrace.direction(dip, azimuth))
+
+        if survey_interval:
+            inner = np.maximum(np.ceil(length / survey_interval) - 1, 0).astype(np.int64)
+        else:
+            inner = np.zeros(n_holes, dtype=np.int64)
+        counts = inner + 2
+        hole = np.repeat(np.arange(n_holes), counts)
+        k = np.arange(hole.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        depth = np.minimum(k * float(survey_interval or 0.0), length[hole])
+        # The last station of every hole sits exactly at its end
+        depth[np.cumsum(counts) - 1] = length
+
+        return (hole, depth, x[hole] + dx[hole] * depth, y[hole] + dy[hole] * depth,
+                z[hole] + dz[hole] * depth)